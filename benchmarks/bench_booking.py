@@ -0,0 +1,154 @@
+"""
+Booking latency benchmark against the local stand-in HSZ server.
+
+For every backend (and browser profile), a bookable course is opened a few
+seconds after the run starts and the time from the opening (T-0) until the
+booking is confirmed is measured, together with the HSPCourse construction
+time.
+
+    python benchmarks/bench_booking.py --rounds 5 --latency 20 --max-ms 500
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from selenium.common.exceptions import WebDriverException
+
+from hsp.booking import HSPCourse, start_headless_chrome
+from hsp.course import Course
+from hsp.credentials import Credentials
+from hsp.errors import CourseNotBookable
+from hsp.httpbooking import HTTPBooking
+from hsp.mockserver import MockHSZ, MockCourse, start_server
+from hsp.scraping import fetch_offer_page
+
+
+COURSE_ID = "12231858"
+PAGE = "_Floorball_Spielbetrieb"
+POLL_INTERVAL = 0.01
+
+credentials = Credentials(
+    name="Max", surname="Mustermann", gender="M", street="Teststr.",
+    number="1", zip_code="52062", city="Aachen", status="S-RWTH",
+    pid="331898", email="max.mustermann@mail.com", tel="0123456789",
+    iban="DE02100100100006820101")
+
+
+def open_mock(latency, opens_in):
+    hsz = MockHSZ([MockCourse(COURSE_ID, page=PAGE)], latency=latency,
+                  opens_at=time.time() + opens_in)
+    server, base_url = start_server(hsz)
+    return hsz, server, Course(COURSE_ID, hsz.offer_url(base_url, PAGE))
+
+
+def run_http(latency, opens_in):
+    hsz, server, course = open_mock(latency, opens_in)
+    try:
+        # like the HSPCourse construction, the first offer page load on
+        # a new connection
+        start = time.perf_counter()
+        booking = HTTPBooking(course)
+        fetch_offer_page(course.url, booking.session)
+        construct = time.perf_counter() - start
+        while True:
+            try:
+                booking.book(credentials)
+                break
+            except CourseNotBookable:
+                time.sleep(POLL_INTERVAL)
+        booked = time.time() - hsz.opens_at
+    finally:
+        server.shutdown()
+    return construct, booked
+
+
+def run_browser(driver, mode, latency, opens_in):
+    hsz, server, course = open_mock(latency, opens_in)
+    try:
+        start = time.perf_counter()
+        booking = HSPCourse(course, driver, backend="browser")
+        construct = time.perf_counter() - start
+        with tempfile.TemporaryDirectory() as tmp:
+            while True:
+                try:
+                    booking.book(credentials, mode=mode,
+                                 confirmation_file=os.path.join(tmp, "c.html"))
+                    break
+                except CourseNotBookable:
+                    time.sleep(POLL_INTERVAL)
+                    booking.refresh(force=True)
+        booked = time.time() - hsz.opens_at
+    finally:
+        server.shutdown()
+    return construct, booked
+
+
+def report(name, samples):
+    """
+    Prints the row of a backend, returns the median T-0 to booked in ms
+    """
+    construct = [c * 1000 for c, _ in samples]
+    booked = [b * 1000 for _, b in samples]
+    median = statistics.median(booked)
+    print("{:<28} {:>10.1f} {:>12.1f} {:>12.1f} {:>12.1f}".format(
+        name, statistics.median(construct), median, min(booked),
+        max(booked)))
+    return median
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="T-0 to booking latency per backend and browser profile")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0,
+                        help="mock server latency per response in ms")
+    parser.add_argument("--opens-in", type=float, default=2,
+                        help="seconds between setup and T-0")
+    parser.add_argument("--no-browser", action="store_true",
+                        help="only benchmark the http backend")
+    parser.add_argument("--max-ms", type=float, default=None,
+                        help="exit with 1 if a backend takes longer (median) "
+                        "from T-0 to the booking")
+    args = parser.parse_args()
+    latency = args.latency / 1000
+    medians = {}
+
+    print("{:<28} {:>10} {:>12} {:>12} {:>12}".format(
+        "backend", "setup ms", "T-0->booked", "min", "max"))
+
+    medians["http"] = report("http", [run_http(latency, args.opens_in)
+                                      for _ in range(args.rounds)])
+
+    if not args.no_browser:
+        run_browsers(args, latency, medians)
+
+    failed = [name for name, median in medians.items()
+              if args.max_ms is not None and median > args.max_ms]
+    if failed:
+        print("[!] Over {} ms from T-0 to the booking: {}".format(
+            args.max_ms, ", ".join(failed)))
+        exit(1)
+
+
+def run_browsers(args, latency, medians):
+    for profile in ("default", "turbo", "low-memory"):
+        try:
+            driver = start_headless_chrome(profile)
+        except WebDriverException as e:
+            print("{:<28} skipped, chrome not available ({})".format(
+                "browser/" + profile, str(e).strip().splitlines()[0]))
+            continue
+        try:
+            for mode in ("keys", "agent"):
+                name = "browser/{}/{}".format(profile, mode)
+                medians[name] = report(
+                    name, [run_browser(driver, mode, latency, args.opens_in)
+                           for _ in range(args.rounds)])
+        finally:
+            driver.quit()
+
+
+if __name__ == "__main__":
+    main()
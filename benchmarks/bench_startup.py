@@ -0,0 +1,101 @@
+"""
+Startup time of every hsp subcommand.
+
+Each subcommand is run in a fresh interpreter with inputs that make it
+finish right away (unreachable URLs, a missing catalog, ...), so the time
+measured is mostly the time spent importing. The bare interpreter and a
+plain "import hsp" are measured as baselines, and every subcommand is
+checked for whether it imported Selenium.
+
+    python benchmarks/bench_startup.py --rounds 10 --max-ms 400
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# nothing listens on the discard port, requests fail immediately
+UNREACHABLE = "http://127.0.0.1:9/angebote/index.html"
+# these start a browser anyway, Selenium is imported up front
+BROWSER_COMMANDS = ("booking", "daemon")
+
+
+def commands(tmp):
+    credentials = os.path.join(ROOT, "credentials.yaml")
+    catalog = os.path.join(tmp, "catalog.db")
+    missing = os.path.join(tmp, "missing.db")
+    hsp = ["-m", "hsp.main"]
+    return [
+        ("python", ["-c", "pass"]),
+        ("import hsp", ["-c", "import hsp"]),
+        ("check-credentials",
+         hsp + ["check-credentials", "--credentials", credentials]),
+        ("find-course",
+         hsp + ["find-course", "--sport", "Floorball", "--catalog", catalog]),
+        ("crawl-catalog",
+         hsp + ["crawl-catalog", "--index", UNREACHABLE, "--catalog",
+                catalog]),
+        ("course-status",
+         hsp + ["course-status", "--course", UNREACHABLE + "#1",
+                "--output", "json"]),
+        ("booking",
+         hsp + ["booking", "--credentials", credentials, "--course", "1",
+                "--catalog", missing]),
+        ("daemon",
+         hsp + ["daemon", "--accounts", os.path.join(tmp, "none")]),
+    ]
+
+
+def run(argv):
+    start = time.perf_counter()
+    subprocess.run([sys.executable] + argv, cwd=ROOT,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def imports_selenium(argv):
+    result = subprocess.run([sys.executable, "-X", "importtime"] + argv,
+                            cwd=ROOT, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, text=True)
+    return any(line.split("|")[-1].strip() == "selenium"
+               for line in result.stderr.splitlines())
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Startup time per hsp subcommand")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--max-ms", type=float, default=None,
+                        help="exit with 1 if a subcommand without a browser " +
+                        "takes longer (median) or imports Selenium")
+    args = parser.parse_args()
+
+    failed = []
+    print("{:<20} {:>10} {:>10} {:>10}  {}".format(
+        "command", "median ms", "min", "max", "selenium"))
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, argv in commands(tmp):
+            samples = [run(argv) * 1000 for _ in range(args.rounds)]
+            selenium = imports_selenium(argv)
+            median = statistics.median(samples)
+            print("{:<20} {:>10.1f} {:>10.1f} {:>10.1f}  {}".format(
+                name, median, min(samples), max(samples),
+                "yes" if selenium else "no"))
+            if args.max_ms is not None and \
+                    name not in BROWSER_COMMANDS and \
+                    (selenium or median > args.max_ms):
+                failed.append(name)
+
+    if failed:
+        print("[!] Over {} ms or importing Selenium: {}".format(
+            args.max_ms, ", ".join(failed)))
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,34 @@
 import argparse
-import time
-from datetime import datetime, timezone
+import asyncio
+from functools import partial
+from datetime import datetime, timedelta
 
 import pytz
 
+from hsp.aio import book_all_async
+from hsp.clock import ServerClock
 from hsp.course import Course
-from hsp.errors import CourseNotBookable
-from hsp.booking import HSPCourse, start_chrome, start_edge
+from hsp.drivers import start_driver
+from hsp.bot import book_course, print_report, wait_until
+from hsp.warmup import warm_login, warm_up, keep_warm
+from hsp.parallel import book_parallel, book_accounts_parallel
+from hsp.hedging import book_hedged, print_hedge_report
+from hsp.accounts import load_accounts, print_account_report
+from hsp.tracing import Tracer
+from hsp.polling import PollScheduler
+from hsp.memory import MemoryMonitor
 from hsp.main import parse_credentials
+from hsp.metadata import MetadataCache
+from hsp.sessions import CookieStore, ensure_login, login_url_for
+from hsp.errors import Error
 
 courses = [
     # TEST
     Course("12231858", "https://buchung.hsz.rwth-aachen.de/angebote/Sommersemester/_Floorball_Spielbetrieb.html"),
     # Course("13531235", "https://buchung.hsz.rwth-aachen.de/angebote/Sommersemester/_Flag-Football_Level_2.html"),
     # Course("15131246", "https://buchung.hsz.rwth-aachen.de/angebote/Sommersemester/_Softball_Level_2_-_3.html", password="password"),
+    # after 'hsp crawl-catalog', courses can be given by ID alone:
+    # Course.from_id("12231858"),
 
     # REAL: SS 2024/2
     # Course("21232116", "https://buchung.hsz.rwth-aachen.de/angebote/Sommersemester/_Trampolin_Treff_Level_1.html"),
@@ -27,45 +42,262 @@ if __name__ == '__main__':
         prog="hsp")
     parser.add_argument('--fire', action='store_true')
     parser.add_argument('--test', action='store_true')
+    parser.add_argument('--backend', choices=("http", "browser"),
+                        default="http",
+                        help="how to check the course status; with 'http' "
+                             "the browser is only started once a course "
+                             "is bookable")
+    parser.add_argument('--parallel', action='store_true',
+                        help="book all courses at once, each in its own "
+                             "process and browser")
+    parser.add_argument('--accounts', nargs='+', default=None,
+                        metavar="PATH",
+                        help="credential files or directories of them; "
+                             "every course is booked for every account at "
+                             "once, each in its own process and session")
+    parser.add_argument('--warm-up', type=int, default=None,
+                        metavar="SECONDS",
+                        help="start the browsers and load the course pages "
+                             "this many seconds before the booking window "
+                             "opens")
+    parser.add_argument('--sync-clock', action='store_true',
+                        help="measure the offset to the server clock and "
+                             "start booking exactly when the server opens "
+                             "the window")
+    parser.add_argument('--agent', action='store_true',
+                        help="fill and submit the booking form with one "
+                             "in-page script instead of typing every field")
+    parser.add_argument('--http-booking', action='store_true',
+                        help="book with plain HTTP requests, without "
+                             "starting a browser")
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help="check and book all courses concurrently over "
+                             "HTTP on one event loop, without a browser; "
+                             "only with --fire, --test, --sync-clock, "
+                             "--http-booking and --poll-rate")
+    parser.add_argument('--hedge', type=int, default=None, metavar="N",
+                        help="book every course with N sessions racing "
+                             "each other (browsers, or HTTP sessions with "
+                             "--http-booking); the first confirmation wins "
+                             "and the others stop before confirming")
+    parser.add_argument('--poll-rate', type=float, default=4,
+                        metavar="REQUESTS",
+                        help="requests per second all courses may poll the "
+                             "server with while they are not bookable; "
+                             "polls are fastest around the opening and "
+                             "back off before and after it")
+    parser.add_argument('--profile', choices=("default", "turbo", "low-memory"),
+                        default="default",
+                        help="browser profile, see 'hsp booking --help'")
+    parser.add_argument('--metadata-ttl', type=float, default=168,
+                        metavar="HOURS",
+                        help="how long the details of a course (time, "
+                             "weekday, location, level) are cached, so "
+                             "retries only read the booking status")
+    parser.add_argument('--refresh-metadata', action='store_true',
+                        help="drop the cached course details first")
+    parser.add_argument('--keep-login', action='store_true',
+                        help="log accounts with a password in before the "
+                             "window opens and keep their session cookies "
+                             "in ~/.hsp/cookies.json, so the booking form "
+                             "needs no login")
+    parser.add_argument('--memory-report', type=float, default=None,
+                        metavar="SECONDS",
+                        help="sample the memory and open windows of the "
+                             "browser at most every SECONDS while polling "
+                             "and print how they developed")
+    parser.add_argument('--trace', default=None, metavar="FILE",
+                        help="write the timings of every booking stage to "
+                             "FILE, to be opened in chrome://tracing or "
+                             "Perfetto")
     args = parser.parse_args()
+    if args.use_async:
+        # the event loop books over plain HTTP with its own sessions
+        unsupported = [option for option, value in (
+            ("--parallel", args.parallel),
+            ("--accounts", args.accounts),
+            ("--backend browser", args.backend != "http"),
+            ("--profile", args.profile != "default"),
+            ("--agent", args.agent),
+            ("--hedge", args.hedge),
+            ("--warm-up", args.warm_up),
+            ("--keep-login", args.keep_login),
+            ("--metadata-ttl",
+             args.metadata_ttl != parser.get_default("metadata_ttl")),
+            ("--refresh-metadata", args.refresh_metadata),
+            ("--memory-report", args.memory_report),
+            ("--trace", args.trace)) if value]
+        if unsupported:
+            parser.error(f"--async can't be combined with "
+                         f"{', '.join(unsupported)}")
 
     fire = args.fire or False
     test = args.test or False
-    credentials = parse_credentials("credentials.yaml")
+    mode = "agent" if args.agent else "keys"
+    if args.http_booking:
+        mode = "http"
+    # a partial of a module level function can still be sent to workers
+    start_browser = partial(start_driver, "edge", args.profile)
+    if args.accounts:
+        accounts = load_accounts(args.accounts)
+        if not accounts:
+            parser.error("no valid credentials in " + ", ".join(args.accounts))
+    else:
+        credentials = parse_credentials("credentials.yaml")
+    metadata = MetadataCache(ttl=args.metadata_ttl * 3600)
+    if args.refresh_metadata:
+        metadata.invalidate()
+    cookie_store = None
+    if args.keep_login:
+        # log in now, so no login is left for the booking window
+        cookie_store = CookieStore()
+        login_url = login_url_for(courses[0].url)
+        for account, creds in (accounts if args.accounts
+                               else [(None, credentials)]):
+            if not creds.password:
+                continue
+            try:
+                ensure_login(creds, login_url, cookie_store)
+                print(f"[*] Logged in as {creds.email}")
+            except Error as e:
+                print(f"[!] Login of {creds.email} failed: {e.msg}")
+    booking_start = booking_cutoff = booking_open = None
+    clock = None
+    scheduler = None
+    tracer = None
     if not fire:
         tz = pytz.timezone('Europe/Berlin')
         cest_now = datetime.now(tz)
         booking_start = cest_now.replace(hour=15, minute=59, second=45, microsecond=0)
         booking_cutoff = cest_now.replace(hour=16, minute=2, second=45, microsecond=0)
+        booking_open = cest_now.replace(hour=16, minute=0, second=0, microsecond=0)
+        if args.sync_clock:
+            # trigger exactly at the server's opening time instead of
+            # polling from 15 seconds early
+            print("[*] Synchronising with the server clock")
+            clock = ServerClock(courses[0].url)
+            clock.sync()
+            booking_start = cest_now.replace(hour=16, minute=0, second=0, microsecond=0)
         print(f"booking window: {booking_start} - {booking_cutoff}")
-        while datetime.now(tz) < booking_start:
-            print(f"waiting {datetime.now(tz)}")
-            time.sleep(1)
-        print("ready")
+        # fast polls around the opening, within one budget for all courses
+        scheduler = PollScheduler(args.poll_rate, booking_open, clock)
+        if args.trace:
+            # started before waiting, T-0 is the opening in local time
+            tracer = Tracer(clock.local_timestamp(booking_open) if clock
+                            else booking_open.timestamp())
+        if args.warm_up:
+            # launch the browsers and load the course pages in advance
+            warm_up_start = booking_start - timedelta(seconds=args.warm_up)
+            wait_until(warm_up_start)
+        else:
+            wait_until(booking_start, clock=clock)
+            print("ready")
 
-    driver = start_edge()
-    for course in courses:
-        print(f"[*] Booking course {course.id}")
-        try:
-            booked = False
-            info_printed = False
-            while not booked:
+    warm_until = booking_start if args.warm_up and not fire else None
+    if args.trace and tracer is None:
+        tracer = Tracer()
+
+    if args.accounts:
+        # every account in its own processes and sessions
+        if scheduler is not None:
+            scheduler = scheduler.share(len(accounts) * len(courses))
+        results = book_accounts_parallel(accounts, courses, start_browser,
+                                         backend=args.backend, test=test,
+                                         fire=fire,
+                                         booking_cutoff=booking_cutoff,
+                                         warm_until=warm_until, clock=clock,
+                                         mode=mode, tracer=tracer,
+                                         metadata=metadata,
+                                         cookie_store=cookie_store,
+                                         scheduler=scheduler)
+    elif args.use_async:
+        # all courses on one event loop and one connection pool
+        results = asyncio.run(book_all_async(courses, credentials, test=test,
+                                             fire=fire,
+                                             booking_cutoff=booking_cutoff,
+                                             scheduler=scheduler))
+    elif args.parallel:
+        # every course in its own process with its own browser
+        if scheduler is not None:
+            scheduler = scheduler.share(len(courses))
+        results = book_parallel(courses, credentials, start_browser,
+                                backend=args.backend, test=test, fire=fire,
+                                booking_cutoff=booking_cutoff,
+                                warm_until=warm_until, clock=clock,
+                                mode=mode, tracer=tracer, metadata=metadata,
+                                cookie_store=cookie_store,
+                                scheduler=scheduler)
+    else:
+        # all courses share one browser, started on first use
+        drivers = []
+        memory = None
+        if args.memory_report:
+            memory = MemoryMonitor(args.memory_report, tracer)
+
+        def shared_browser():
+            if not drivers:
+                drivers.append(start_browser())
+            return drivers[0]
+
+        # one warm browser per course, parked on its offer page
+        warm = {}
+        if warm_until is not None and args.hedge:
+            # hedges start their sessions when the window opens
+            wait_until(warm_until, clock=clock)
+        elif warm_until is not None:
+            print("[*] Warming up browser sessions")
+            for course in courses:
                 try:
-                    booking = HSPCourse(course, driver)
-                    if not info_printed:
-                        print("... " + booking.info())
-                        info_printed = True
-                    booking.book(credentials, test)
-                    booked = True
-                except CourseNotBookable:
-                    if fire:
-                        raise
-                    if datetime.now(tz) < booking_cutoff:
-                        print(f"unable to book yet {datetime.now(tz)}")
-                        time.sleep(1)
-                    else:
-                        print(f"past booking cutoff, not retrying")
-                        raise
-        except Exception as e:
-            print(f"[ERROR] Failed to book course {course.id}")
-    pass
+                    if mode == "http":
+                        # no browser to warm up, only the login
+                        warm_login(course, credentials, cookie_store)
+                        continue
+                    warm[course.id] = warm_up(course, start_browser,
+                                              metadata, credentials,
+                                              cookie_store,
+                                              backend=args.backend)
+                except Exception as e:
+                    print(f"[ERROR] Warm-up failed for course {course.id}: {e}")
+                else:
+                    warm[course.id].memory = memory
+            keep_warm(list(warm.values()), warm_until, clock=clock)
+            print("ready")
+
+        results = []
+        for course in courses:
+            print(f"[*] Booking course {course.id}")
+            if args.hedge:
+                # every hedge with its own session, started at once
+                result = book_hedged(course, credentials, start_browser,
+                                     args.hedge, backend=args.backend,
+                                     test=test, fire=fire,
+                                     booking_cutoff=booking_cutoff,
+                                     mode=mode, tracer=tracer,
+                                     metadata=metadata,
+                                     cookie_store=cookie_store,
+                                     scheduler=scheduler)
+                print_hedge_report(result)
+                results.append(result)
+                continue
+            result = book_course(course, credentials, shared_browser,
+                                 backend=args.backend, test=test, fire=fire,
+                                 booking_cutoff=booking_cutoff,
+                                 booking=warm.get(course.id), mode=mode,
+                                 tracer=tracer, metadata=metadata,
+                                 cookie_store=cookie_store,
+                                 scheduler=scheduler, memory=memory)
+            if not result.booked:
+                print(f"[ERROR] Failed to book course {course.id}")
+            results.append(result)
+
+        if memory is not None:
+            if drivers:
+                memory.sample(drivers[0], force=True)
+            memory.report()
+
+    if args.accounts:
+        print_account_report(results)
+    else:
+        print_report(results)
+    if tracer is not None:
+        tracer.write(args.trace)
@@ -1,5 +1,14 @@
-from .booking import (HSPCourse, start_firefox, start_headless_firefox,
-                        start_chrome, start_headless_chrome)
 from .credentials import Credentials
 from .errors import (CourseIdNotListed, CourseIdAmbiguous, CourseNotBookable,
                     InvalidCredentials)
+
+# hsp.booking pulls in Selenium, so it is only imported on first use
+_LAZY = ("HSPCourse", "start_firefox", "start_headless_firefox",
+         "start_chrome", "start_headless_chrome", "start_edge")
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        from . import booking
+        return getattr(booking, name)
+    raise AttributeError("module 'hsp' has no attribute {!r}".format(name))
@@ -0,0 +1,75 @@
+import os
+
+import yaml
+
+from .credentials import Credentials
+from .errors import InvalidCredentials
+
+
+CREDENTIAL_FILE_ENDINGS = (".yaml", ".yml", ".json")
+
+
+def _credential_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(CREDENTIAL_FILE_ENDINGS):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+
+def load_accounts(paths):
+    """
+    Credentials of several people, from credential files and directories
+    of credential files (.yaml, .yml or .json).
+    Returns a list of (account, Credentials), the account being the file
+    name without its ending. Invalid files are reported and skipped.
+    """
+    accounts = []
+    for path in _credential_files(paths):
+        account = os.path.splitext(os.path.basename(path))[0]
+        try:
+            if path.lower().endswith(".json"):
+                credentials = Credentials.from_json(path)
+            else:
+                credentials = Credentials.from_yaml(path)
+        except InvalidCredentials as e:
+            print("[!] Skipping account {}: {}".format(account, e.msg))
+            continue
+        except (OSError, ValueError, TypeError, yaml.YAMLError) as e:
+            # unreadable or malformed, e.g. no mapping at the top level
+            print("[!] Skipping account {}: {}".format(account, e))
+            continue
+        accounts.append((account, credentials))
+    return accounts
+
+
+def print_account_report(results):
+    """
+    Report BookingResults of several accounts, per account and per course
+    """
+    print("[*] Booking report per account")
+    accounts = []
+    for result in results:
+        if result.account not in accounts:
+            accounts.append(result.account)
+    for account in accounts:
+        own = [result for result in results if result.account == account]
+        booked = sum(1 for result in own if result.booked)
+        print("... {}: {}/{} courses booked".format(account, booked, len(own)))
+        for result in own:
+            print("...     " + str(result))
+
+    print("[*] Booking report per course")
+    courses = []
+    for result in results:
+        if result.course_id not in courses:
+            courses.append(result.course_id)
+    for course_id in courses:
+        own = [result for result in results if result.course_id == course_id]
+        booked = [result.account for result in own if result.booked]
+        failed = [result.account for result in own if not result.booked]
+        print("... course {}: booked for {}/{} accounts{}".format(
+            course_id, len(booked), len(own),
+            " (failed: {})".format(", ".join(failed)) if failed else ""))
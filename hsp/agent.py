@@ -0,0 +1,150 @@
+# In-page booking agent: fills, submits and confirms the booking form with a
+# single asynchronous script instead of one webdriver command per field.
+# The form pages are submitted with fetch(), so the script survives the page
+# changes; the final page is written into the tab afterwards.
+
+# arguments: [[name or #id, value], ...], confirmation email, test, callback
+# reports {ok, stage, error}
+BOOKING_AGENT_JS = """
+var fields = arguments[0];
+var email = arguments[1];
+var test = arguments[2];
+var done = arguments[arguments.length - 1];
+
+function report(ok, stage, error) {
+    done({ok: ok, stage: stage, error: error || null});
+}
+
+function setField(form, key, value) {
+    var els = key.charAt(0) === "#"
+        ? [document.getElementById(key.substring(1))]
+        : Array.prototype.slice.call(form.querySelectorAll('[name="' + key + '"]'));
+    els = els.filter(function (el) { return el; });
+    if (!els.length) {
+        return false;
+    }
+    els.forEach(function (el) {
+        if (el.type === "radio" || el.type === "checkbox") {
+            el.checked = (el.value === value);
+        } else {
+            el.value = value;
+        }
+        el.dispatchEvent(new Event("input", {bubbles: true}));
+        el.dispatchEvent(new Event("change", {bubbles: true}));
+    });
+    return true;
+}
+
+function post(form, submitter, baseUrl) {
+    var data = new FormData(form);
+    if (submitter && submitter.name) {
+        data.append(submitter.name, submitter.value);
+    }
+    var action = new URL(form.getAttribute("action") || baseUrl, baseUrl);
+    return fetch(action.href, {
+        method: "POST",
+        body: new URLSearchParams(data),
+        credentials: "include"
+    }).then(function (response) {
+        var type = response.headers.get("content-type") || "";
+        var charset = (type.match(/charset=([^;]+)/i) || [null, "utf-8"])[1];
+        return response.arrayBuffer().then(function (buffer) {
+            var html = new TextDecoder(charset.trim()).decode(buffer);
+            return {url: response.url, html: html,
+                    doc: new DOMParser().parseFromString(html, "text/html")};
+        });
+    });
+}
+
+function show(page) {
+    document.open();
+    document.write(page.html);
+    document.close();
+}
+
+var submit = document.querySelector("input[type=submit][value='weiter zur Buchung']");
+if (!submit || !submit.form) {
+    return report(false, "fill", "booking form not found");
+}
+var form = submit.form;
+
+var missing = fields.filter(function (field) {
+    return !setField(form, field[0], field[1]);
+}).map(function (field) { return field[0]; });
+// the iban field is optional
+missing = missing.filter(function (key) { return key !== "iban"; });
+if (missing.length) {
+    form.reset();
+    return report(false, "fill", "fields not found: " + missing.join(", "));
+}
+var eula = form.querySelector("input[type=checkbox][name=tnbed]");
+if (eula) {
+    eula.checked = true;
+}
+
+// skip the countdown
+try {
+    document.getElementById("bs_counter").className = "hidden";
+    document.getElementById("bs_submit").className = "sub";
+    window.send = 1;
+} catch (e) {}
+
+var stage = "submit";
+post(form, submit, window.location.href).then(function (page) {
+    var confirm = page.doc.querySelector("input[type=submit][value*='buchen']");
+    if (!confirm || page.doc.querySelector("input[type=checkbox][name=tnbed]")) {
+        // the form came back, the input was rejected
+        form.reset();
+        var error = page.doc.querySelector(".bs_text_red");
+        return report(false, "submit",
+                      error ? error.textContent.trim() : "form was rejected");
+    }
+    var check = page.doc.querySelector("input.bs_form_field[name^='email_check_']");
+    if (check) {
+        check.setAttribute("value", email);
+    }
+    if (test) {
+        show(page);
+        return report(true, "submit");
+    }
+    stage = "confirm";
+    return post(confirm.form, confirm, page.url).then(function (ticket) {
+        show(ticket);
+        var failed = ticket.doc.querySelector("div.bs_text_red.bs_text_big");
+        report(!failed, "confirm",
+               failed ? failed.textContent.trim() : null);
+    });
+}).catch(function (e) {
+    report(false, stage, String(e));
+});
+"""
+
+
+def agent_fields(credentials, login=False):
+    """
+    Form fields and values for BOOKING_AGENT_JS, in the order they are set.
+    After a user login the form is prefilled and only the fields updated by
+    HSPCourse._update_personal_details and the iban are set.
+    """
+    fields = []
+    if not login:
+        # the status select decides which pid field is shown
+        fields.append(["#BS_F1600", credentials.status])
+        if credentials.status in ("S-RWTH", "S-aH"):
+            fields.append(["matnr", credentials.pid])
+        elif credentials.status in ("B-UNIT", "B-UKT", "B-aH"):
+            fields.append(["mitnr", credentials.pid])
+        fields += [
+            ["sex", credentials.gender],
+            ["vorname", credentials.name],
+            ["name", credentials.surname],
+            ["email", credentials.email],
+            ["telefon", credentials.tel],
+        ]
+
+    fields += [
+        ["strasse", credentials.street + " " + credentials.number],
+        ["ort", credentials.zip_code + " " + credentials.city],
+        ["iban", credentials.iban],
+    ]
+    return fields
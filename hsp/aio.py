@@ -0,0 +1,234 @@
+import asyncio
+import time
+from datetime import datetime
+
+import aiohttp
+
+from .bot import BookingResult
+from .errors import CourseNotBookable, Error, LoadingFailed
+from .httpbooking import HTTPBooking
+from .tickets import default_writer
+from .scraping import CourseStatus, FreshnessPolicy, PageSnapshot, USER_AGENT
+
+
+def new_async_session(pool_size=100, connector=None):
+    """
+    aiohttp session with a pool of up to pool_size connections.
+    Sessions created with the connector of another session share its pool,
+    but have their own cookies.
+    """
+    if connector is None:
+        return aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=pool_size),
+            headers={"User-Agent": USER_AGENT})
+    return aiohttp.ClientSession(connector=connector, connector_owner=False,
+                                 headers={"User-Agent": USER_AGENT})
+
+
+async def _request(session, method, url, timeout, **kwargs):
+    try:
+        async with session.request(
+                method, url, timeout=aiohttp.ClientTimeout(total=timeout),
+                **kwargs) as response:
+            response.raise_for_status()
+            return str(response.url), await response.read(), response.charset
+    except asyncio.TimeoutError as e:
+        print(e)
+        raise LoadingFailed("Timeout while loading {}".format(url))
+    except aiohttp.ClientError as e:
+        print(e)
+        raise LoadingFailed("Request for {} failed".format(url))
+
+
+class AsyncHTTPBooking(HTTPBooking):
+    """
+    HTTPBooking on an aiohttp session
+    """
+
+    async def book(self, credentials, test=False):
+        steps = self._steps(credentials, test)
+        try:
+            method, url, kwargs = next(steps)
+            while True:
+                self._load(*await _request(self.session, method, url,
+                                           self.timeout, **kwargs))
+                method, url, kwargs = steps.send(None)
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            # as in HTTPBooking.book, a failed request must not leave the
+            # steps suspended
+            steps.close()
+
+
+class AsyncPageCache:
+    """
+    Offer page snapshots shared by the courses on one event loop, see
+    hsp.scraping.PageCache. A page is loaded once per freshness period
+    and concurrent loads of one page wait for a single request.
+    """
+
+    def __init__(self, session, timeout=20, freshness=None):
+        self.session = session
+        self.timeout = timeout
+        self.freshness = freshness or FreshnessPolicy()
+        self.snapshots = {}
+        self.loads = 0
+        self._page_locks = {}
+
+    async def snapshot(self, url, force=False):
+        page_lock = self._page_locks.setdefault(url, asyncio.Lock())
+        async with page_lock:
+            snapshot = self.snapshots.get(url)
+            if force or self.freshness.is_stale(snapshot):
+                _, content, _ = await _request(self.session, "GET", url,
+                                               self.timeout)
+                snapshot = PageSnapshot.from_html(url, content)
+                self.snapshots[url] = snapshot
+                self.loads += 1
+            return snapshot
+
+
+class AsyncHSPCourse(CourseStatus):
+    """
+    Status checks and HTTP level booking of a course on an asyncio event
+    loop. Create it with `await AsyncHSPCourse.create(course, session)`.
+    All courses of one session share its connection pool.
+    pages: AsyncPageCache, so courses on the same offer page share its loads
+    """
+
+    def __init__(self, course, session, timeout=20, pages=None):
+        self.timeout = timeout
+        self.course = course
+        self.session = session
+        self.pages = pages
+        self._snapshot = None
+
+        self.time = None
+        self.weekday = None
+        self.location = None
+        self.level = None
+        self.course_name = None
+        self.booking_possible = None
+        self.waitinglist_exists = None
+        self.course_status = None
+
+    @classmethod
+    async def create(cls, course, session, timeout=20, pages=None):
+        self = cls(course, session, timeout, pages)
+        await self.refresh()
+        return self
+
+    async def refresh(self, force=False):
+        """
+        Reload the offer page and update details and status. With pages,
+        a load of the page by another course is reused while fresh, unless
+        force is set.
+        """
+        if self.pages is not None:
+            self._snapshot = await self.pages.snapshot(self.course.url,
+                                                       force)
+        else:
+            _, content, _ = await _request(self.session, "GET",
+                                           self.course.url, self.timeout)
+            self._snapshot = PageSnapshot.from_html(self.course.url, content)
+        self._apply_scraped(self._snapshot.course(self.course.id))
+
+    async def book(self, credentials, test=False):
+        """
+        Book the course over HTTP, returns the BookingConfirmation
+        """
+        if self.has_waitinglist() or not self.is_bookable():
+            raise CourseNotBookable(self.course.id, self.status())
+
+        # separate cookies for every booking, connections from the pool
+        async with new_async_session(connector=self.session.connector) \
+                as session:
+            booking = AsyncHTTPBooking(self.course, session, self.timeout)
+            return await booking.book(credentials, test)
+
+
+async def book_with_retry_async(course, credentials, session, test=False,
+                                fire=False, booking_cutoff=None,
+                                retry_interval=1, scheduler=None,
+                                pages=None):
+    """
+    Async counterpart of hsp.bot.book_with_retry for the HTTP engine
+    scheduler: hsp.polling.PollScheduler shared by all courses on the loop
+    pages: AsyncPageCache shared by all courses on the loop
+    """
+    booking = await AsyncHSPCourse.create(course, session, pages=pages)
+    print("... " + booking.info())
+    while True:
+        try:
+            confirmation = await booking.book(credentials, test)
+            outfile = "booking_confirmation_{}.html".format(course.id)
+            # written in a thread, not on the event loop
+            default_writer().submit(confirmation.content, outfile,
+                                    confirmation.url)
+            return confirmation
+        except CourseNotBookable:
+            if fire or booking_cutoff is None:
+                raise
+            now = datetime.now(booking_cutoff.tzinfo)
+            if now < booking_cutoff:
+                print("unable to book {} yet {}".format(course.id, now))
+                if scheduler is None:
+                    await asyncio.sleep(retry_interval)
+                else:
+                    await asyncio.sleep(scheduler.reserve())
+                attempt = time.monotonic()
+                await booking.refresh()
+                if scheduler is not None:
+                    scheduler.record(time.monotonic() - attempt)
+            else:
+                print("past booking cutoff, not retrying")
+                raise
+
+
+async def _book_course_async(course, credentials, session, timeout, **kwargs):
+    start = time.monotonic()
+    try:
+        await asyncio.wait_for(
+            book_with_retry_async(course, credentials, session, **kwargs),
+            timeout)
+    except asyncio.TimeoutError:
+        return BookingResult(course.id, False,
+                             "timed out after {}s".format(timeout))
+    except Error as e:
+        return BookingResult(course.id, False, e.msg)
+    except Exception as e:
+        return BookingResult(course.id, False, repr(e))
+    return BookingResult(course.id, True, duration=time.monotonic() - start)
+
+
+async def book_all_async(courses, credentials, timeout=None, pool_size=100,
+                         **kwargs):
+    """
+    Book all courses concurrently on one event loop.
+    timeout: seconds after which the booking of a single course is
+             cancelled, None to wait for the booking cutoff
+    kwargs are passed to book_with_retry_async.
+    Returns the BookingResults in the order of courses.
+    """
+    async with new_async_session(pool_size) as session:
+        # courses on the same offer page share its loads
+        kwargs.setdefault("pages", AsyncPageCache(session))
+        return await asyncio.gather(*[
+            _book_course_async(course, credentials, session, timeout,
+                               **kwargs)
+            for course in courses])
+
+
+async def check_all_async(courses, timeout=None, pool_size=100):
+    """
+    Status of all courses, fetched concurrently. Every offer page is
+    loaded once, however many of the courses are on it.
+    Returns an AsyncHSPCourse or the raised exception per course.
+    """
+    async with new_async_session(pool_size) as session:
+        pages = AsyncPageCache(session)
+        return await asyncio.gather(*[
+            asyncio.wait_for(AsyncHSPCourse.create(course, session,
+                                                   pages=pages), timeout)
+            for course in courses], return_exceptions=True)
@@ -8,201 +8,463 @@ from selenium.webdriver.common.by import By
 from selenium.common.exceptions import (NoSuchElementException,
                                         TimeoutException,
                                         WebDriverException)
-from .errors import (CourseIdNotListed, CourseIdAmbiguous,
-                     CourseNotBookable, InvalidCredentials, LoadingFailed)
-from .conditions import submit_successful, element_inner_html_has_changed
-
-
-def start_firefox():
+from .errors import (CourseNotBookable, InvalidCredentials, LoadingFailed,
+                     BookingFailed)
+from selenium.webdriver.chromium.webdriver import ChromiumDriver
+from .conditions import submit_successful, page_transitioned
+from .agent import BOOKING_AGENT_JS, agent_fields
+from .tracing import NULL_TRACER
+from .sessions import add_to_driver, cookies_from_driver
+from .tickets import (Ticket, default_writer, find_refusal, parse_ticket,
+                      verify_ticket)
+from .scraping import (fetch_offer_page, classify_booking_element,
+                       course_from_extractor, FreshnessPolicy, PageSnapshot,
+                       CourseStatus, COURSE_EXTRACTOR_JS, COURSE_STATUS_JS,
+                       status_from_extractor, parse_offer_page)
+
+
+# Browser profiles for the start_* factories.
+# "turbo" only waits for the DOM and skips images, fonts, analytics and the
+# cache; "low-memory" additionally drops stylesheets and trims the browser's
+# process and memory footprint, for many concurrent headless sessions.
+BROWSER_PROFILES = {
+    "default": {},
+    "turbo": {"page_load_strategy": "eager", "block_resources": True,
+              "disable_cache": True},
+    "low-memory": {"page_load_strategy": "eager", "block_resources": True,
+                   "block_stylesheets": True, "disable_cache": True,
+                   "low_memory": True},
+}
+
+BLOCKED_URLS = ["*.png", "*.jpg", "*.jpeg", "*.gif", "*.svg", "*.ico",
+                "*.webp", "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+                "*google-analytics.com*", "*googletagmanager.com*",
+                "*matomo*", "*piwik*"]
+
+
+def _get_profile(profile):
+    try:
+        return BROWSER_PROFILES[profile]
+    except KeyError:
+        raise ValueError("Unknown browser profile '{}', choose one of {}".format(
+            profile, tuple(BROWSER_PROFILES)))
+
+
+def _apply_firefox_profile(ff_options, profile):
+    settings = _get_profile(profile)
+    if "page_load_strategy" in settings:
+        ff_options.page_load_strategy = settings["page_load_strategy"]
+    if settings.get("block_resources"):
+        ff_options.set_preference("permissions.default.image", 2)
+        ff_options.set_preference("gfx.downloadable_fonts.enabled", False)
+    if settings.get("block_stylesheets"):
+        ff_options.set_preference("permissions.default.stylesheet", 2)
+    if settings.get("disable_cache"):
+        ff_options.set_preference("browser.cache.disk.enable", False)
+        ff_options.set_preference("browser.cache.memory.enable", False)
+    if settings.get("low_memory"):
+        ff_options.set_preference("dom.ipc.processCount", 1)
+        ff_options.set_preference("browser.sessionhistory.max_total_viewers", 0)
+        ff_options.set_preference("browser.sessionstore.interval", 600000)
+
+
+def _apply_chromium_profile(options, profile):
+    settings = _get_profile(profile)
+    if "page_load_strategy" in settings:
+        options.page_load_strategy = settings["page_load_strategy"]
+    if settings.get("block_resources"):
+        options.add_argument("--blink-settings=imagesEnabled=false")
+        options.add_experimental_option(
+            "prefs", {"profile.managed_default_content_settings.images": 2})
+    if settings.get("disable_cache"):
+        options.add_argument("--disk-cache-size=1")
+    if settings.get("low_memory"):
+        options.add_argument("--renderer-process-limit=1")
+        options.add_argument("--disable-site-isolation-trials")
+        options.add_argument("--disable-features=site-per-process")
+        options.add_argument("--disable-extensions")
+        options.add_argument("--disable-gpu")
+        options.add_argument("--disable-dev-shm-usage")
+        options.add_argument("--disable-background-networking")
+        options.add_argument("--mute-audio")
+        options.add_argument("--js-flags=--max-old-space-size=128")
+
+
+def _apply_devtools_profile(driver, profile):
+    """
+    Resource blocking that is only available through DevTools.
+    Applies to the current tab of the driver; HSPCourse applies it again
+    to every booking tab (see driver.hsp_profile).
+    """
+    driver.hsp_profile = profile
+    settings = _get_profile(profile)
+    blocked = []
+    if settings.get("block_resources"):
+        blocked += BLOCKED_URLS
+    if settings.get("block_stylesheets"):
+        blocked.append("*.css")
+    if not blocked and not settings.get("disable_cache"):
+        return
+    driver.execute_cdp_cmd("Network.enable", {})
+    if blocked:
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": blocked})
+    if settings.get("disable_cache"):
+        driver.execute_cdp_cmd("Network.setCacheDisabled",
+                               {"cacheDisabled": True})
+
+
+def start_firefox(profile="default"):
 
-    driver = webdriver.Firefox()
+    ff_options = FirefoxOptions()
+    _apply_firefox_profile(ff_options, profile)
+    driver = webdriver.Firefox(options=ff_options)
     return driver
 
 
-def start_headless_firefox():
+def start_headless_firefox(profile="default"):
 
     ff_options = FirefoxOptions()
     ff_options.headless = True
+    _apply_firefox_profile(ff_options, profile)
     driver = webdriver.Firefox(options=ff_options)
     return driver
 
 
-def start_chrome():
+def start_chrome(profile="default"):
     chrome_options = ChromeOptions()
     chrome_options.add_experimental_option("detach", True)
     # prevent detection with window.navigator.webdriver check
     chrome_options.add_argument('--disable-blink-features=AutomationControlled')
+    # DevTools events for page transition detection
+    chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    _apply_chromium_profile(chrome_options, profile)
     driver = webdriver.Chrome(options=chrome_options)
+    _apply_devtools_profile(driver, profile)
     # driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined});window.navigator = navigator;")
     return driver
 
 
-def start_headless_chrome():
+def start_headless_chrome(profile="default"):
 
     chrome_options = ChromeOptions()
     chrome_options.add_argument("--headless")
+    chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    _apply_chromium_profile(chrome_options, profile)
     driver = webdriver.Chrome(options=chrome_options)
+    _apply_devtools_profile(driver, profile)
     return driver
 
 
-def start_edge():
+def start_edge(profile="default"):
     edge_options = EdgeOptions()
     edge_options.add_experimental_option("detach", True)
     # prevent detection with window.navigator.webdriver check
     edge_options.add_argument('--disable-blink-features=AutomationControlled')
+    # DevTools events for page transition detection
+    edge_options.set_capability("ms:loggingPrefs", {"performance": "ALL"})
+    _apply_chromium_profile(edge_options, profile)
     driver = webdriver.Edge(options=edge_options)
+    _apply_devtools_profile(driver, profile)
     return driver
 
 
-class HSPCourse:
+class HSPCourse(CourseStatus):
     """
+    backend: "browser" scrapes the offer page with the webdriver,
+             "http" fetches and parses it without a browser. The driver is
+             then only started (with start_driver) once the course is booked.
+    metadata: hsp.metadata.MetadataCache; with cached details, only the
+              booking status is read from the offer page
+    cookie_store: hsp.sessions.CookieStore; a stored login of the account
+                  replaces the login on the booking form
+    writer: hsp.tickets.ConfirmationWriter saving the ticket pages, the
+            process wide one by default
+    max_windows: most windows / tabs kept open in the driver; the offer
+                 page stays in one pinned tab and the booking tabs of an
+                 attempt are closed after it
+    memory: hsp.memory.MemoryMonitor sampling the browser's memory on
+            every refresh and booking
+    pages: hsp.scraping.PageCache shared with other courses, so with the
+           "http" backend their common offer pages are loaded once
     """
 
-    def __init__(self, course, driver=None):
+    def __init__(self, course, driver=None, backend="browser", session=None,
+                 start_driver=None, freshness=None, tracer=None,
+                 metadata=None, cookie_store=None, writer=None,
+                 max_windows=3, memory=None, pages=None):
         self.timeout = 20  # waiting time for site to load in seconds
-        self.driver = driver or self._init_driver()
+        self.tracer = tracer or NULL_TRACER
+        self.max_windows = max_windows
+        self.memory = memory
+        self.pages = pages
+        self._offer_window = None  # handle of the pinned offer page tab
+        self._booking_windows = []
+        self.backend = backend
+        self.session = session
+        self.start_driver = start_driver
+        self.driver = driver
+        if self.driver is None and self.backend == "browser":
+            self.driver = self._init_driver()
         self.course = course
+        # the offer page is loaded once and reloaded only when stale
+        self.freshness = freshness or FreshnessPolicy()
+        self._snapshot = None
+        self.metadata = metadata
+
         self.time = None
         self.weekday = None
         self.location = None
         self.level = None
+        self.course_name = None
+        self._details_known = False
         self._scrape_course_detail()
 
-        self.course_name = None
         self.booking_possible = None
         self.waitinglist_exists = None
         self.course_status = None
         self._scrape_course_status()
 
         self._booking_page = None
+        self._devtools_events = None
+        # snapshot the browser's offer page was loaded with (http backend)
+        self._browser_snapshot = None
+
+        self.cookie_store = cookie_store
+        self._session_cookies = None
+        self._session_email = None
+
+        self.writer = writer
+        self.ticket = None  # hsp.tickets.Ticket, once booked
+
+    def _load_snapshot(self, force=False):
+        if self.backend == "http" and self.pages is not None:
+            # a forced load bypasses the snapshots shared by other courses
+            self._snapshot = self.pages.snapshot(self.course.url,
+                                                 self.freshness, force)
+            return
+        if self.backend == "http":
+            content = fetch_offer_page(self.course.url, self.session,
+                                       self.timeout)
+            self._snapshot = PageSnapshot.from_html(self.course.url, content)
+            return
+
+        self._switch_to_offer_window()
+        try:
+            self.driver.get(self.course.url)
+        except TimeoutException as e:
+            print(e)
+            raise LoadingFailed("Timeout while loading course list page")
+
+        if self._details_known:
+            # only the booking button / status is still needed
+            result = self.driver.execute_script(COURSE_STATUS_JS,
+                                                self.course.id)
+            scraped = status_from_extractor(result, self.course.id)
+            self._snapshot = PageSnapshot(self.course.url,
+                                          statuses={self.course.id: scraped})
+            return
+
+        # read the whole course row in a single webdriver command
+        result = self.driver.execute_script(COURSE_EXTRACTOR_JS,
+                                            self.course.id)
+        scraped = course_from_extractor(result, self.course.id)
+        self._snapshot = PageSnapshot(self.course.url,
+                                      courses={self.course.id: scraped})
+
+    def _get_snapshot(self):
+        if self.freshness.is_stale(self._snapshot):
+            self._load_snapshot()
+        return self._snapshot
 
     def _get_el_from_coursepage(self, xpath):
 
         assert(self.driver.current_url == self.course.url)
         return self.driver.find_element("xpath", xpath)
 
-    def _cl_get_time(self, course_row_xpath):
+    def _cl_get_time(self):
 
-        time_xpath = course_row_xpath + '/td[@class="bs_szeit"]'
-        return self._get_el_from_coursepage(time_xpath).text
+        return self._get_snapshot().course(self.course.id)["time"]
 
-    def _cl_get_weekday(self, course_row_xpath):
+    def _cl_get_weekday(self):
 
-        weekday_xpath = course_row_xpath + '/td[@class="bs_stag"]'
-        return self._get_el_from_coursepage(weekday_xpath).text
+        return self._get_snapshot().course(self.course.id)["weekday"]
 
-    def _cl_get_location(self, course_row_xpath):
+    def _cl_get_location(self):
 
-        location_xpath = course_row_xpath + '/td[@class="bs_sort"]'
-        return self._get_el_from_coursepage(location_xpath).text
+        return self._get_snapshot().course(self.course.id)["location"]
 
-    def _cl_get_level(self, course_row_xpath):
+    def _cl_get_level(self):
 
-        location_xpath = course_row_xpath + '/td[@class="bs_sdet"]'
-        return self._get_el_from_coursepage(location_xpath).text
+        return self._get_snapshot().course(self.course.id)["level"]
 
     def _cp_get_course_name(self):
 
-        title_xp = "//div[@class='bs_head']"
-        course_name_div = self._get_el_from_coursepage(title_xp)
-        return course_name_div.text
+        return self._get_snapshot().course(self.course.id)["course_name"]
 
     def _cp_get_bookingbtn_or_status_element(self):
 
+        scraped = self._get_snapshot().status(self.course.id)
+        return (scraped["booking_tag"], scraped["booking_class"],
+                scraped["booking_text"])
+
+    def _cp_get_bookingbtn(self):
+        """
+        The live booking button on the offer page, needed to click it
+        """
         course_code = "K" + self.course.id
         xpath = "//a[@id='{}']/following::*".format(course_code)
         return self._get_el_from_coursepage(xpath)
 
     def _scrape_course_detail(self):
-        try:
-            self.driver.get(self.course.url)
 
-            # course site features a table:
-            # extract the row that starts with the course id
-            xpath = '//td[text()="{}"]/parent::tr'
-            course_row_xpath = xpath.format(self.course.id)
+        cached = self.metadata.get(self.course) if self.metadata else None
+        if cached is not None:
+            self.time = cached["time"]
+            self.weekday = cached["weekday"]
+            self.location = cached["location"]
+            self.level = cached["level"]
+            self.course_name = cached["course_name"]
+            self._details_known = True
+            return
+
+        # course site features a table:
+        # the row that starts with the course id holds the details
+        self.time = self._cl_get_time()
+        self.weekday = self._cl_get_weekday()
+        self.location = self._cl_get_location()
+        self.level = self._cl_get_level()
+        self.course_name = self._cp_get_course_name()
+        self._details_known = True
+        if self.metadata is not None:
+            self.metadata.put(self.course, {
+                "time": self.time, "weekday": self.weekday,
+                "location": self.location, "level": self.level,
+                "course_name": self.course_name})
 
-            self.time = self._cl_get_time(course_row_xpath)
-            self.weekday = self._cl_get_weekday(course_row_xpath)
-            self.location = self._cl_get_location(course_row_xpath)
-            self.level = self._cl_get_level(course_row_xpath)
-            # self.course_page_url = self._cl_get_course_link(course_row_xpath)
+    def _scrape_course_status(self):
 
-        except TimeoutException as e:
-            print(e)
-            raise LoadingFailed("Timeout while loading course list page")
+        tag, css_class, text = self._cp_get_bookingbtn_or_status_element()
 
-        except NoSuchElementException as e:
-            print(e)
-            raise CourseIdNotListed(self.course.id)
+        (self.course_status,
+         self.booking_possible,
+         self.waitinglist_exists) = classify_booking_element(tag, css_class,
+                                                             text)
 
-    def _scrape_course_status(self):
+    def refresh(self, force=False):
+        """
+        Update the course status, reloading the offer page only if the
+        snapshot is stale (or force is set)
+        """
+        if force:
+            self._load_snapshot(force=True)
+        # the details of a course don't change, only its status
+        self._scrape_course_status()
+        self._drain_devtools_events()
+        if self.memory is not None and self.driver is not None:
+            self.memory.sample(self.driver)
 
-        self.driver.get(self.course.url)
+    def park(self):
+        """
+        Start the browser, if it is not running yet, and load the offer
+        page in it. With the http backend, the polls stay on HTTP and the
+        browser only needs a reload and the click once the course is
+        bookable.
+        """
+        if self.driver is None:
+            self.driver = self._init_driver()
+        self._switch_to_offer_window()
+        try:
+            self.driver.get(self.course.url)
+        except TimeoutException as e:
+            print(e)
+            raise LoadingFailed("Timeout while loading course list page")
+        self._browser_snapshot = self._snapshot
 
-        self.course_name = self._cp_get_course_name()
-        bookbtn_or_status = self._cp_get_bookingbtn_or_status_element()
-
-        # If bookbtn_or_status is a <span> ... </span> element,
-        # the course is not bookable and there is it contains a
-        # no-booking-possible status
-        if bookbtn_or_status.tag_name == "span":
-            self.course_status = bookbtn_or_status.text
-            self.booking_possible = False
-            self.waitinglist_exists = False
-
-        elif "bs_btn_warteliste" in bookbtn_or_status.get_attribute("class"):
-            self.course_status = "queue signup"
-            self.booking_possible = False
-            self.waitinglist_exists = True
-
-        elif "bs_btn_buchen" in bookbtn_or_status.get_attribute("class"):
-            self.course_status = "booking possible"
-            self.booking_possible = True
-            self.waitinglist_exists = False
-
-        else:
-            self.course_status = "unknown"
-            self.booking_possible = False
-            self.waitinglist_exists = False
+    def _switch_to_offer_window(self):
+        """
+        Back to the pinned offer page tab, closing the booking tabs of the
+        last attempt. The first tab used for the offer page is pinned.
+        """
+        if self._booking_windows:
+            self._close_booking_windows()
+        if self._offer_window is None:
+            self._offer_window = self.driver.current_window_handle
+
+    def _close_booking_windows(self):
+        handles = self.driver.window_handles
+        for handle in self._booking_windows:
+            # the last window of a driver ends its session
+            if handle in handles and handle != self._offer_window and \
+                    len(handles) > 1:
+                self.driver.switch_to.window(handle)
+                self.driver.close()
+                handles.remove(handle)
+        self._booking_windows = []
+        if self._offer_window not in handles:
+            self._offer_window = handles[0]
+        self.driver.switch_to.window(self._offer_window)
+
+    def _limit_windows(self):
+        """
+        Close the oldest windows beyond max_windows, except the pinned
+        offer page and the current one
+        """
+        handles = self.driver.window_handles
+        excess = len(handles) - self.max_windows
+        if excess <= 0:
+            return
+        current = self.driver.current_window_handle
+        for handle in handles:
+            if excess <= 0:
+                break
+            if handle in (current, self._offer_window):
+                continue
+            self.driver.switch_to.window(handle)
+            self.driver.close()
+            excess -= 1
+        self.driver.switch_to.window(current)
 
     def _init_driver(self):
 
+        if self.start_driver is not None:
+            return self.start_driver()
+
         try:
             driver = start_headless_chrome()
         except WebDriverException as e:
             print(e)
             print("[!] Loading Chrome webdriver failed")
             print("... Attempting to use Firefox webdriver")
-            driver = start_headless_chrome()
+            driver = start_headless_firefox()
         return driver
 
-    def info(self):
-        infostr = "#{}: {} {}, {} {}".format(self.course.id or "",
-                                             self.course_name or "",
-                                             self.level or "",
-                                             self.weekday or "",
-                                             self.time or "")
-        return infostr
-
-    def status(self):
-        return "Status: {}".format(self.course_status)
-
-    def is_bookable(self):
-        return self.booking_possible
-
-    def has_waitinglist(self):
-        return self.waitinglist_exists
-
     def _switch_to_booking_page(self):
 
         if self.has_waitinglist() or not self.is_bookable():
             raise CourseNotBookable(self.course.id, self.status())
 
-        self.driver.get(self.course.url)
+        # the http backend starts the browser only for bookable courses
+        if self.driver is None:
+            self.driver = self._init_driver()
+
+        self._switch_to_offer_window()
+
+        # reuse the loaded offer page, unless it is outdated or the browser
+        # has not shown it yet; a browser parked by the http backend shows
+        # the page from before the polls found the course bookable
+        if self.freshness.is_stale(self._snapshot) or \
+                self.driver.current_url != self.course.url or \
+                (self.backend == "http" and
+                 self._browser_snapshot is not self._snapshot):
+            self.driver.get(self.course.url)
+            self._browser_snapshot = self._snapshot
+
+        if self._session_cookies:
+            add_to_driver(self.driver, self._session_cookies)
+            self._session_cookies = None
 
         # at this point, the course is bookable
-        booking_btn = self._cp_get_bookingbtn_or_status_element()
+        booking_btn = self._cp_get_bookingbtn()
 
         # snapshot of open windows / tabs
         old_windows = self.driver.window_handles
@@ -214,7 +476,15 @@ class HSPCourse:
         new_tab = (set(self.driver.window_handles) - set(old_windows)).pop()
 
         # switch to new tab
+        self._booking_windows.append(new_tab)
         self.driver.switch_to.window(new_tab)
+        self._limit_windows()
+
+        # the blocking of the profile is per tab, for the submits of the
+        # booking form and the confirmation
+        profile = getattr(self.driver, "hsp_profile", None)
+        if profile is not None and isinstance(self.driver, ChromiumDriver):
+            _apply_devtools_profile(self.driver, profile)
 
         # make the window larger, so no fields are being hidden
         self.driver.set_window_size(height=1500, width=2000)
@@ -318,6 +588,22 @@ class HSPCourse:
         eula = wait.until(EC.presence_of_element_located((By.XPATH, eula_xpath,)))
         eula.click()
 
+    def use_session(self, credentials, cookies):
+        """
+        Log the browser in with the stored session cookies of the account
+        (see hsp.sessions), so the booking form needs no login
+        """
+        self._session_email = credentials.email
+        self._session_cookies = cookies
+        if self.driver is not None and \
+                self.driver.current_url == self.course.url:
+            add_to_driver(self.driver, cookies)
+            self._session_cookies = None
+
+    def _bp_logged_in(self):
+        login_xpath = '//div[@id="bs_pw_anmlink"]'
+        return not self.driver.find_elements("xpath", login_xpath)
+
     def _bp_enter_user_login(self, credentials):
         assert (self.driver.current_url == self._booking_page)
 
@@ -374,13 +660,66 @@ class HSPCourse:
 
     def _retry_submit(self, submit_loc, control_loc):
         """
-        Retry submitting, until control_loc disappears
+        Retry submitting, until control_loc disappears.
+        On Chrome/Edge the form is submitted once and the page change is
+        taken from the DevTools events instead of polling.
         """
 
         assert(self.driver.current_url == self._booking_page)
 
+        # submit once and wait for the DevTools events of the page change
+        if self._has_devtools_events():
+            with self.tracer.span("_retry_submit attempt", attempt=1,
+                                  detection="devtools"):
+                self.driver.get_log("performance")
+                self.driver.find_element(*submit_loc).submit()
+                wait = WebDriverWait(self.driver, self.timeout,
+                                     poll_frequency=0.01)
+                wait.until(page_transitioned())
+                submitted = not self.driver.find_elements(*control_loc)
+            if submitted:
+                return
+            # the same form came back, keep on submitting
+
+        condition = submit_successful(submit_loc, control_loc)
+        attempts = []
+
+        def traced_condition(driver):
+            attempts.append(None)
+            with self.tracer.span("_retry_submit attempt",
+                                  attempt=len(attempts), detection="polling"):
+                return condition(driver)
+
         wait = WebDriverWait(self.driver, self.timeout)
-        wait.until(submit_successful(submit_loc, control_loc))
+        wait.until(traced_condition)
+
+    def _has_devtools_events(self):
+        """
+        Chrome and Edge report network and page events in the performance
+        log, if it was enabled when starting the driver
+        """
+        if self._devtools_events is None:
+            self._devtools_events = False
+            if isinstance(self.driver, ChromiumDriver):
+                try:
+                    self.driver.get_log("performance")
+                    self._devtools_events = True
+                except WebDriverException:
+                    pass
+        return self._devtools_events
+
+    def _drain_devtools_events(self):
+        """
+        Discards the performance log. Only the submits read it, so it is
+        emptied on every refresh and attempt instead of growing while the
+        course is polled.
+        """
+        if self.driver is None or not self._has_devtools_events():
+            return
+        try:
+            self.driver.get_log("performance")
+        except WebDriverException:
+            pass
 
     def _bp_wait_until_submit(self):
         """
@@ -413,46 +752,169 @@ class HSPCourse:
 
         self._retry_submit(submit_locator, control_locator)
 
-    def _save_screenshot(self, outfile):
+    def _bp_run_agent(self, credentials, login, test):
+        """
+        Fills, submits and confirms the form with the in-page booking agent.
+        Returns False if the form was not submitted (e.g. because it rejected
+        the programmatic input), so the typed input can take over.
+        """
+        assert (self.driver.current_url == self._booking_page)
+
+        if not credentials or not credentials.is_valid():
+            raise InvalidCredentials("Credentials are invalid")
 
+        self.driver.set_script_timeout(self.timeout)
+        result = self.driver.execute_async_script(
+            BOOKING_AGENT_JS, agent_fields(credentials, login),
+            credentials.email, test)
+
+        if result["ok"]:
+            return True
+        if result["stage"] in ("fill", "submit"):
+            print("[!] Booking agent failed: {}".format(result["error"]))
+            print("... Falling back to typed input")
+            return False
+        raise BookingFailed("Booking agent failed to confirm: {}".format(
+            result["error"]))
+
+    def _bp_confirm_gated(self, confirm_gate, test, outfile):
+        """
+        Confirms inside the gate of a hedged booking, which cancels this
+        hedge if another one has already booked the course. The ticket is
+        verified while the gate is held, so a refused confirmation raises
+        BookingRefused there and the next hedge may try.
+        """
+        with confirm_gate():
+            if not test:
+                with self.tracer.span("_bp_wait_until_confirm",
+                                      course=self.course.id):
+                    self._bp_wait_until_confirm()
+            with self.tracer.span("_capture_ticket", course=self.course.id):
+                self._capture_ticket(outfile, test)
+
+    def _capture_ticket(self, outfile, test):
+        """
+        Snapshots the ticket page in one call and hands it to the
+        background writer. Unless test, the booking is verified from the
+        parsed ticket: it needs a booking number for this course.
+        """
         if outfile is None:
-            tmpl = "booking_confirmation_{}.png"
+            tmpl = "booking_confirmation_{}.html"
             outfile = tmpl.format(self.course.id)
 
-        # save the final page as a screenshot
-        self.driver.save_screenshot(outfile)
-        print("[*] Booking ticket saved to {}".format(outfile))
+        url = self.driver.current_url
+        content = self.driver.page_source
+        # saved either way, a failed booking's page is kept for inspection
+        writer = self.writer or default_writer()
+        writer.submit(content, outfile, url)
 
-    def book(self, credentials, test=False, confirmation_file=None):
-
-        self._switch_to_booking_page()
+        if not test:
+            document = parse_offer_page(content)
+            self.ticket = Ticket.from_details(parse_ticket(document))
+            verify_ticket(self.ticket, self.course.id,
+                          find_refusal(document))
+            print("[*] " + str(self.ticket))
+
+    def book(self, credentials, test=False, confirmation_file=None,
+             mode="keys", confirm_gate=None):
+        """
+        mode: "keys" types the data into the form field by field,
+              "agent" fills and submits the form with one in-page script and
+              falls back to "keys" if the form rejects it
+        confirm_gate: callable returning a context manager the final
+                      confirmation is sent in, see hsp.hedging
+        Every stage is recorded as a span of self.tracer. Afterwards, the
+        booking tab is closed and the driver is back on the offer page.
+        """
+        try:
+            self._book(credentials, test, confirmation_file, mode,
+                       confirm_gate)
+        finally:
+            self._end_attempt()
+
+    def _end_attempt(self):
+        if self.driver is None:
+            return
+        if self._booking_windows:
+            try:
+                self._close_booking_windows()
+            except WebDriverException as e:
+                print("[!] Closing the booking tab failed: {}".format(e))
+        self._drain_devtools_events()
+        if self.memory is not None:
+            self.memory.sample(self.driver)
+
+    def _book(self, credentials, test, confirmation_file, mode,
+              confirm_gate):
+
+        span = self.tracer.span
+
+        if credentials.password and self.cookie_store is not None and \
+                self._session_email != credentials.email:
+            cookies = self.cookie_store.get(credentials.email)
+            if cookies:
+                self.use_session(credentials, cookies)
+
+        with span("_switch_to_booking_page", course=self.course.id):
+            self._switch_to_booking_page()
 
         # fill in password if exists
         if self.course.password:
-            self._bp_enter_password(self.course.password)
-
-        if credentials.password:
-            self._bp_enter_user_login(credentials)
-            self._bp_confirm_user_login()
-            self._update_personal_details(credentials)
-            self._bp_enter_iban(credentials)
-        else:
-            # verify and fill in the personal data
-            self._bp_enter_personal_details(credentials)
-
-        self._bp_agree_to_eula()
+            with span("_bp_enter_password", course=self.course.id):
+                self._bp_enter_password(self.course.password)
+
+        # a stored session skips the login, an expired one falls back to it
+        if credentials.password and not self._bp_logged_in():
+            with span("_bp_enter_user_login", course=self.course.id):
+                self._bp_enter_user_login(credentials)
+                self._bp_confirm_user_login()
+            if self.cookie_store is not None:
+                self.cookie_store.put(credentials.email,
+                                      cookies_from_driver(self.driver))
+
+        if mode == "agent":
+            # behind a gate, the agent stops at the confirmation page
+            with span("_bp_run_agent", course=self.course.id):
+                booked = self._bp_run_agent(
+                    credentials, bool(credentials.password),
+                    test or confirm_gate is not None)
+            if booked and confirm_gate is not None:
+                self._bp_confirm_gated(confirm_gate, test, confirmation_file)
+                return
+            if booked:
+                with span("_capture_ticket", course=self.course.id):
+                    self._capture_ticket(confirmation_file, test)
+                return
+
+        with span("_bp_enter_personal_details", course=self.course.id):
+            if credentials.password:
+                self._update_personal_details(credentials)
+                self._bp_enter_iban(credentials)
+            else:
+                # verify and fill in the personal data
+                self._bp_enter_personal_details(credentials)
+
+        with span("_bp_agree_to_eula", course=self.course.id):
+            self._bp_agree_to_eula()
 
         # wait until inputs are submited and page changes
-        self._bp_wait_until_submit()
+        with span("_bp_wait_until_submit", course=self.course.id):
+            self._bp_wait_until_submit()
 
         # fill in confirm email field, if it exists
-        self._bp_enter_confirm_email(credentials.email)
+        with span("_bp_enter_confirm_email", course=self.course.id):
+            self._bp_enter_confirm_email(credentials.email)
 
         # wait until confirm button is pressed and page changes
+        if confirm_gate is not None:
+            self._bp_confirm_gated(confirm_gate, test, confirmation_file)
+            return
         if not test:
-            self._bp_wait_until_confirm()
+            with span("_bp_wait_until_confirm", course=self.course.id):
+                self._bp_wait_until_confirm()
 
-        self._save_screenshot(confirmation_file)
+        with span("_capture_ticket", course=self.course.id):
+            self._capture_ticket(confirmation_file, test)
 
         # close the driver
         # self.driver.quit()
@@ -0,0 +1,185 @@
+import time
+from datetime import datetime
+
+from .booking import HSPCourse
+from .errors import BookingCancelled, CourseNotBookable, Error
+from .httpbooking import HTTPBooking
+from .tickets import default_writer
+from .tracing import NULL_TRACER
+from .warmup import warm_login, warm_up, keep_warm
+
+
+class BookingResult:
+
+    def __init__(self, course_id, booked, error=None, duration=None,
+                 trace_events=None, account=None):
+        self.course_id = course_id
+        self.booked = booked
+        self.error = error
+        self.duration = duration
+        self.trace_events = trace_events
+        self.account = account
+
+    def __str__(self):
+        course = "course {}".format(self.course_id)
+        if self.account is not None:
+            course += " for {}".format(self.account)
+        if self.booked:
+            return "[OK] {} booked in {:.1f}s".format(course, self.duration)
+        return "[ERROR] {} not booked: {}".format(course, self.error)
+
+
+def wait_until(moment, interval=1, clock=None):
+    """
+    Block until the timezone aware datetime moment.
+    With a synchronised ServerClock, moment is taken as server time and the
+    wait ends one request latency early, so a request sent then arrives
+    at moment.
+    """
+    margin = interval if clock is not None else 0
+    while True:
+        now = clock.now() if clock else datetime.now(moment.tzinfo)
+        remaining = (moment - now).total_seconds()
+        if remaining <= margin:
+            break
+        print("waiting {}".format(now.astimezone(moment.tzinfo)))
+        time.sleep(min(interval, remaining - margin))
+
+    if clock is not None:
+        clock.sleep_until(moment)
+
+
+def book_with_retry(course, credentials, start_driver, backend="http",
+                    test=False, fire=False, booking_cutoff=None,
+                    retry_interval=1, booking=None, mode="keys",
+                    tracer=None, metadata=None, confirmation_file=None,
+                    cookie_store=None, confirm_gate=None, scheduler=None,
+                    memory=None, pages=None):
+    """
+    Book a course, retrying while it is not bookable yet.
+    Unless fire is set, CourseNotBookable is only raised once booking_cutoff
+    (a timezone aware datetime) has passed.
+    booking: an already loaded (e.g. warmed up) HSPCourse to start from
+    mode: form filling mode, see HSPCourse.book, or "http" to book
+          without a browser with HTTPBooking
+    tracer: hsp.tracing.Tracer recording the status checks and booking stages
+    metadata: hsp.metadata.MetadataCache with the details of the course
+    confirmation_file: where to save the ticket page, by default
+                       booking_confirmation_<course id>.html, gzip
+                       compressed if it ends with .gz
+    cookie_store: hsp.sessions.CookieStore with the login of the account
+    confirm_gate: for hedged bookings, see hsp.hedging
+    scheduler: hsp.polling.PollScheduler timing the retries, instead of
+               every retry_interval seconds
+    memory: hsp.memory.MemoryMonitor sampling the browser during the retries
+    pages: hsp.scraping.PageCache shared by courses on the same offer pages
+    Returns the HSPCourse that was booked, or the BookingConfirmation
+    in "http" mode.
+    """
+    tracer = tracer or NULL_TRACER
+    if booking is not None:
+        booking.tracer = tracer
+    if booking is not None and cookie_store is not None:
+        booking.cookie_store = cookie_store
+    if booking is not None and memory is not None:
+        booking.memory = memory
+    http_booking = None
+    if mode == "http":
+        http_booking = HTTPBooking(course, cookie_store=cookie_store,
+                                   confirm_gate=confirm_gate)
+    while True:
+        attempt = time.monotonic()
+        # the first attempt may start the browser, only polls are timed
+        polled = http_booking is not None or booking is not None
+        try:
+            if http_booking is not None:
+                with tracer.span("HTTPBooking.book", course=course.id):
+                    confirmation = http_booking.book(credentials, test)
+                outfile = confirmation_file or \
+                    "booking_confirmation_{}.html".format(course.id)
+                # written in the background, the next booking goes on
+                default_writer().submit(confirmation.content, outfile,
+                                        confirmation.url)
+                return confirmation
+            if booking is None:
+                with tracer.span("HSPCourse", course=course.id):
+                    booking = HSPCourse(course, backend=backend,
+                                        start_driver=start_driver,
+                                        tracer=tracer, metadata=metadata,
+                                        cookie_store=cookie_store,
+                                        memory=memory, pages=pages)
+                print("... " + booking.info())
+            else:
+                # reloads the offer page once the snapshot is stale
+                with tracer.span("refresh", course=course.id):
+                    booking.refresh()
+            booking.book(credentials, test, confirmation_file, mode=mode,
+                         confirm_gate=confirm_gate)
+            return booking
+        except CourseNotBookable:
+            if fire or booking_cutoff is None:
+                raise
+            now = datetime.now(booking_cutoff.tzinfo)
+            if now < booking_cutoff:
+                print("unable to book {} yet {}".format(course.id, now))
+                if scheduler is None:
+                    time.sleep(retry_interval)
+                    continue
+                if polled:
+                    scheduler.record(time.monotonic() - attempt)
+                scheduler.wait()
+            else:
+                print("past booking cutoff, not retrying")
+                raise
+
+
+def book_course(course, credentials, start_driver, warm_until=None,
+                keep_alive_interval=30, clock=None, cancelled=None,
+                on_start=None, **kwargs):
+    """
+    book_with_retry, reporting the outcome as a BookingResult.
+    With warm_until, the browser is started and parked on the offer page
+    right away and kept alive until then (server time, if a clock is
+    given); the "http" backend keeps polling over HTTP meanwhile. In
+    "http" mode, where no browser is used, only the account is logged in.
+    cancelled: threading.Event ending the warm-up early
+    on_start: called right before the booking starts, returns False to
+              cancel it (BookingCancelled)
+    """
+    start = time.monotonic()
+    try:
+        if warm_until is not None and kwargs.get("mode") == "http":
+            warm_login(course, credentials, kwargs.get("cookie_store"))
+            keep_warm([], warm_until, keep_alive_interval, clock,
+                      cancelled)
+            start = time.monotonic()
+        elif warm_until is not None:
+            booking = warm_up(course, start_driver, kwargs.get("metadata"),
+                              credentials, kwargs.get("cookie_store"),
+                              backend=kwargs.get("backend", "http"))
+            keep_warm([booking], warm_until, keep_alive_interval, clock,
+                      cancelled)
+            kwargs["booking"] = booking
+            start = time.monotonic()
+        if on_start is not None and not on_start():
+            raise BookingCancelled(course.id)
+        book_with_retry(course, credentials, start_driver, **kwargs)
+    except Error as e:
+        result = BookingResult(course.id, False, e.msg)
+    except Exception as e:
+        result = BookingResult(course.id, False, repr(e))
+    else:
+        result = BookingResult(course.id, True,
+                               duration=time.monotonic() - start)
+    # send the spans back from worker processes
+    if kwargs.get("tracer") is not None:
+        result.trace_events = kwargs["tracer"].events
+    return result
+
+
+def print_report(results):
+    print("[*] Booking report")
+    for result in results:
+        print("... " + str(result))
+    booked = sum(1 for result in results if result.booked)
+    print("... {}/{} courses booked".format(booked, len(results)))
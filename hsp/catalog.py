@@ -0,0 +1,217 @@
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlsplit
+
+from .errors import CatalogNotFound, Error
+
+
+DEFAULT_INDEX_URL = \
+    "https://buchung.hsz.rwth-aachen.de/angebote/Sommersemester/index.html"
+DEFAULT_CATALOG = os.path.join(os.path.expanduser("~"), ".hsp", "catalog.db")
+
+_TIME = r"(\d{1,2})[:.](\d{2})"
+_TIME_RANGE = re.compile(_TIME + r"\s*-\s*" + _TIME)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS courses (
+    id TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    sport TEXT,
+    level TEXT,
+    weekday TEXT,
+    time TEXT,
+    start TEXT,
+    end TEXT,
+    location TEXT,
+    status TEXT,
+    crawled_at REAL
+);
+CREATE INDEX IF NOT EXISTS courses_sport ON courses (sport);
+CREATE INDEX IF NOT EXISTS courses_start ON courses (start);
+"""
+
+COLUMNS = ("id", "url", "sport", "level", "weekday", "time", "start", "end",
+           "location", "status", "crawled_at")
+
+
+def _clock_time(text):
+    # "9:30" and "9.30" -> "09:30", comparable as strings
+    match = re.fullmatch(_TIME, text.strip())
+    if match is None:
+        raise ValueError("Invalid time: {}".format(text))
+    return "{:0>2}:{}".format(*match.groups())
+
+
+def parse_time_range(text):
+    """
+    ("HH:MM", "HH:MM") of a course time such as "18:00-19:30",
+    (None, None) if there is none
+    """
+    match = _TIME_RANGE.search(text or "")
+    if match is None:
+        return None, None
+    h1, m1, h2, m2 = match.groups()
+    return "{:0>2}:{}".format(h1, m1), "{:0>2}:{}".format(h2, m2)
+
+
+def find_offer_pages(index_url, session=None, timeout=20):
+    """
+    URLs of all offer pages linked from the semester's angebote/ index
+    """
+    from .scraping import fetch_offer_page, parse_offer_page
+
+    document = parse_offer_page(
+        fetch_offer_page(index_url, session, timeout))
+    base = urljoin(index_url, ".")
+
+    urls = []
+    for href in document.xpath("//a/@href"):
+        url = urljoin(index_url, href).split("#")[0]
+        # offer pages are the _<Sport>.html pages next to the index
+        name = urlsplit(url).path.rsplit("/", 1)[-1]
+        if url.startswith(base) and name.startswith("_") and \
+                name.endswith(".html") and url not in urls:
+            urls.append(url)
+    return urls
+
+
+def crawl_offer_page(url, session=None, timeout=20):
+    """
+    Catalog rows of all courses on one offer page
+    """
+    from .scraping import (classify_booking_element, fetch_offer_page,
+                           parse_offer_page, scrape_all_courses)
+
+    document = parse_offer_page(fetch_offer_page(url, session, timeout))
+    crawled_at = time.time()
+
+    rows = []
+    for course_id, scraped in scrape_all_courses(document).items():
+        status, _, _ = classify_booking_element(
+            scraped["booking_tag"], scraped["booking_class"],
+            scraped["booking_text"])
+        start, end = parse_time_range(scraped["time"])
+        rows.append({
+            "id": course_id, "url": url, "sport": scraped["course_name"],
+            "level": scraped["level"], "weekday": scraped["weekday"],
+            "time": scraped["time"], "start": start, "end": end,
+            "location": scraped["location"], "status": status,
+            "crawled_at": crawled_at})
+    return rows
+
+
+class CourseCatalog:
+    """
+    On-disk index of the course rows of all offer pages, so courses can
+    be found and resolved by id without loading the site.
+    """
+
+    def __init__(self, path=DEFAULT_CATALOG):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def update(self, rows):
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO courses ({}) VALUES ({})".format(
+                    ", ".join(COLUMNS), ", ".join("?" * len(COLUMNS))),
+                [tuple(row[column] for column in COLUMNS) for row in rows])
+
+    def lookup(self, course_id):
+        """
+        The catalog row of a course as a dict, None if it is not listed
+        """
+        row = self.db.execute("SELECT * FROM courses WHERE id = ?",
+                              (str(course_id),)).fetchone()
+        return dict(row) if row is not None else None
+
+    def query(self, sport=None, weekday=None, after=None, before=None):
+        """
+        Catalog rows matching all given filters.
+        sport: part of the sport's name, case insensitive
+        weekday: e.g. "Mo", matches "Mo" as well as "Mo, Mi"
+        after: "HH:MM", courses starting at or after
+        before: "HH:MM", courses ending at or before
+        """
+        clauses = []
+        params = []
+        if sport:
+            clauses.append("sport LIKE ?")
+            params.append("%{}%".format(sport))
+        if weekday:
+            clauses.append("weekday LIKE ?")
+            params.append("%{}%".format(weekday))
+        if after:
+            clauses.append("start >= ?")
+            params.append(_clock_time(after))
+        if before:
+            clauses.append("end <= ?")
+            params.append(_clock_time(before))
+
+        sql = "SELECT * FROM courses"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY sport, start, id"
+        return [dict(row) for row in self.db.execute(sql, params)]
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM courses").fetchone()[0]
+
+
+def crawl(index_url=DEFAULT_INDEX_URL, path=DEFAULT_CATALOG, max_workers=8,
+          timeout=20):
+    """
+    Load the index and all offer pages in parallel and store every course
+    row in the catalog at path. Returns the number of courses stored.
+    """
+    # requests and lxml are only needed for crawling, lookups by id
+    # (Course.from_id, find-course) work without them
+    from .scraping import new_session
+
+    session = new_session(pool_size=max_workers)
+    urls = find_offer_pages(index_url, session, timeout)
+    print("[*] Crawling {} offer pages".format(len(urls)))
+
+    def crawl_page(url):
+        try:
+            return crawl_offer_page(url, session, timeout)
+        except Error as e:
+            print("[!] Skipping {}: {}".format(url, e.msg))
+            return []
+
+    rows = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for page_rows in pool.map(crawl_page, urls):
+            rows.extend(page_rows)
+
+    with CourseCatalog(path) as catalog:
+        catalog.update(rows)
+    return len(rows)
+
+
+def resolve_course_url(course_id, path=DEFAULT_CATALOG):
+    """
+    Offer page URL of a course from the catalog
+    """
+    if not os.path.exists(path):
+        raise CatalogNotFound(path)
+    with CourseCatalog(path) as catalog:
+        row = catalog.lookup(course_id)
+    return row["url"] if row is not None else None
@@ -74,6 +74,13 @@ def add_course_arg(subparser):
         help="ID of the hochschulsport course")
 
 
+def add_catalog_arg(subparser):
+    subparser.add_argument(
+        "--catalog", type=str, default=None,
+        help="Path of the course catalog database " +
+        "(default: ~/.hsp/catalog.db)")
+
+
 def add_browser_selection_group(subparser):
     browser_select = subparser.add_mutually_exclusive_group(
                         required=False)
@@ -95,6 +102,13 @@ def add_browser_selection_group(subparser):
             "--use-headless-chrome", action="store_true",
             help="Use a headless chrome session during the " +
             "booking process. This is used by default.")
+    subparser.add_argument(
+            "--profile", choices=("default", "turbo", "low-memory"),
+            default="default",
+            help="Browser profile. 'turbo' only waits for the page " +
+            "structure and skips images, fonts, analytics and the cache. " +
+            "'low-memory' also skips stylesheets and limits the " +
+            "browser's processes, for many concurrent headless sessions.")
 
 
 def parse_args():
@@ -121,8 +135,73 @@ def parse_args():
     status_parser = subparsers.add_parser(
                         "course-status", help="Check the " +
                         "status of a hochschulsport course")
-    add_course_arg(status_parser)
-    add_browser_selection_group(status_parser)
+    status_parser.add_argument(
+            "--course", type=str, nargs="+", default=[],
+            help="Course IDs (looked up in the course catalog), offer " +
+            "page URLs (all courses of the page) or offer page URLs " +
+            "with the course ID as fragment (...html#12231858)")
+    status_parser.add_argument(
+            "--jobs", type=str, default=None,
+            help="JSON or YAML file with a list of courses to check")
+    status_parser.add_argument(
+            "--output", choices=("table", "json", "ndjson"),
+            default="table",
+            help="Output format, json and ndjson for scripts")
+    status_parser.add_argument(
+            "--workers", type=int, default=8,
+            help="Number of offer pages loaded in parallel")
+    add_catalog_arg(status_parser)
+
+    # CATALOG SUBCOMMANDS
+    crawl_parser = subparsers.add_parser(
+                        "crawl-catalog", help="Index all courses of the " +
+                        "semester in the local course catalog")
+    crawl_parser.add_argument(
+            "--index", type=str, default=None,
+            help="URL of the semester's angebote/ index page")
+    crawl_parser.add_argument(
+            "--workers", type=int, default=8,
+            help="Number of offer pages loaded in parallel")
+    add_catalog_arg(crawl_parser)
+
+    find_parser = subparsers.add_parser(
+                        "find-course", help="Search the local course " +
+                        "catalog")
+    find_parser.add_argument(
+            "--sport", type=str, default=None,
+            help="Part of the name of the sport")
+    find_parser.add_argument(
+            "--weekday", type=str, default=None,
+            help="Weekday abbreviation, e.g. Mo")
+    find_parser.add_argument(
+            "--after", type=str, default=None,
+            help="Courses starting at or after HH:MM")
+    find_parser.add_argument(
+            "--before", type=str, default=None,
+            help="Courses ending at or before HH:MM")
+    add_catalog_arg(find_parser)
+
+    # DAEMON SUBCOMMAND
+    daemon_parser = subparsers.add_parser(
+                        "daemon", help="Keep running and accept booking " +
+                        "and status jobs on a local JSON API")
+    daemon_parser.add_argument(
+            "--accounts", type=str, nargs="+", required=True,
+            help="Credential files or directories of credential files")
+    daemon_parser.add_argument(
+            "--port", type=int, default=8765,
+            help="Port of the job API on 127.0.0.1")
+    daemon_parser.add_argument(
+            "--http-booking", action="store_true",
+            help="Book with plain HTTP requests, without a browser")
+    daemon_parser.add_argument(
+            "--keep-login", action="store_true",
+            help="Reuse and store the login sessions of the accounts")
+    daemon_parser.add_argument(
+            "--browsers", type=int, default=2,
+            help="Browsers kept open between booking jobs")
+    add_catalog_arg(daemon_parser)
+    add_browser_selection_group(daemon_parser)
 
     # BOOKING SUBCOMMAND
     booking_parser = subparsers.add_parser(
@@ -130,18 +209,41 @@ def parse_args():
                         help="book a hochschulsport course")
     add_credentials_arg(booking_parser)
     add_course_arg(booking_parser)
+    add_catalog_arg(booking_parser)
     add_browser_selection_group(booking_parser)
     booking_parser.add_argument(
-            "--booking-out", default="confirmation.png",
+            "--booking-out", default="confirmation.html",
             action=OutfileAction,
-            help="File destination to write a screenshot of the" +
-            "confirmation page to. PNG format will be used.")
+            help="File destination to write the confirmation page " +
+            "(HTML) to, gzip compressed if it ends with .gz")
+    booking_parser.add_argument(
+            "--start", type=str, default=None,
+            help="Local time (HH:MM:SS) at which the booking window " +
+            "opens. Booking is started then.")
+    booking_parser.add_argument(
+            "--warm-up", action="store_true",
+            help="Start the browser and load the course page right " +
+            "away and keep the session alive until --start, so only the " +
+            "booking is left when the window opens")
+    booking_parser.add_argument(
+            "--agent", action="store_true",
+            help="Fill and submit the booking form with a single " +
+            "in-page script instead of typing every field. Falls back " +
+            "to typing if the form rejects the input.")
 
     args = parser.parse_args()
 
     if not args.subcommand:
         msg = "No task selected. Choose on of 'check-credentials', " + \
-                "'course-status', 'booking'."
+                "'course-status', 'booking', 'crawl-catalog', 'find-course', " + \
+                "'daemon'."
         parser.error(msg)
 
+    if args.subcommand == "course-status" and not args.course and \
+            not args.jobs:
+        parser.error("course-status requires --course or --jobs")
+
+    if args.subcommand == "booking" and args.warm_up and not args.start:
+        parser.error("--warm-up requires --start")
+
     return args
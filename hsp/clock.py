@@ -0,0 +1,115 @@
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+
+from .errors import LoadingFailed
+from .scraping import get_session
+
+
+class ServerClock:
+    """
+    Estimate of the HSZ server's clock, derived from the HTTP Date header.
+
+    The Date header only has a resolution of one second. Every probe bounds
+    the offset (server - local) to [date - t_received, date + 1 - t_sent].
+    Probes are timed so that the server's second tick is expected in the
+    middle of the remaining interval, which roughly halves it every time,
+    until it is as narrow as the request jitter allows.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.offset = None  # server time - local time in seconds
+        self.uncertainty = None  # half width of the offset interval
+        self.latency = None  # one way request latency in seconds
+
+    def _probe(self, session):
+        sent = time.time()
+        try:
+            response = session.head(self.url, timeout=5)
+        except requests.RequestException as e:
+            print(e)
+            raise LoadingFailed("Probing the server clock failed")
+        received = time.time()
+        try:
+            date = parsedate_to_datetime(response.headers["Date"])
+        except (KeyError, TypeError, ValueError):
+            raise LoadingFailed("Server sent no usable Date header")
+        return sent, received, date.timestamp()
+
+    def sync(self, probes=10, precision=0.002):
+        """
+        Measure offset and latency. Takes about one second per probe.
+        """
+        session = get_session()
+        # the first request opens the connection and is not representative
+        self._probe(session)
+
+        low, high = float("-inf"), float("inf")
+        round_trips = []
+        for _ in range(probes):
+            if high - low < 2 * precision:
+                break
+            if round_trips:
+                # aim the server's stamp at the next second tick of the
+                # current offset estimate
+                offset = (low + high) / 2
+                rtt = sorted(round_trips)[len(round_trips) // 2]
+                stamp = time.time() + offset + rtt / 2
+                send_at = int(stamp) + 1 - offset - rtt / 2
+                time.sleep(max(0, send_at - time.time()))
+
+            sent, received, date = self._probe(session)
+            round_trips.append(received - sent)
+            low = max(low, date - received)
+            high = min(high, date + 1 - sent)
+
+        if low > high:
+            # inconsistent probes (e.g. the local clock was adjusted)
+            low = high = (low + high) / 2
+
+        self.offset = (low + high) / 2
+        self.uncertainty = (high - low) / 2
+        self.latency = sorted(round_trips)[len(round_trips) // 2] / 2
+        print("... server clock offset {:+.1f} ms (+-{:.1f} ms), "
+              "request latency {:.1f} ms".format(self.offset * 1000,
+                                                 self.uncertainty * 1000,
+                                                 self.latency * 1000))
+
+    def now(self):
+        """
+        Current server time as a timezone aware datetime
+        """
+        return datetime.fromtimestamp(time.time() + self.offset,
+                                      timezone.utc)
+
+    def local_timestamp(self, moment):
+        """
+        time.time() value at which the server clock shows moment
+        """
+        return moment.timestamp() - self.offset
+
+    def sleep_until(self, moment, lead=None, spin=0.02):
+        """
+        Sleep until a request sent now reaches the server at moment
+        (a timezone aware datetime in server time).
+        lead: seconds to wake early, the measured request latency by default
+        """
+        if lead is None:
+            lead = self.latency
+        wake = self.local_timestamp(moment) - lead
+
+        # coarse sleep, then spin for the last milliseconds
+        remaining = wake - time.time()
+        if remaining > spin:
+            time.sleep(remaining - spin)
+        while time.time() < wake:
+            pass
+
+        woke = time.time()
+        print("... triggered at server time {} ({:+.2f} ms late, "
+              "clock offset +-{:.1f} ms)".format(
+                  self.now().astimezone(moment.tzinfo).time(),
+                  (woke - wake) * 1000, self.uncertainty * 1000))
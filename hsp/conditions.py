@@ -1,4 +1,5 @@
 from selenium.common.exceptions import NoSuchElementException
+import json
 import time
 
 
@@ -24,6 +25,38 @@ class submit_successful(object):
             return True
 
 
+class page_transitioned(object):
+    """An expectation for a form POST to return and the new document to be
+    ready, based on the DevTools network and page events of the performance
+    log. Needs a Chrome/Edge driver with the performance log enabled.
+    The log must be drained right before submitting.
+    """
+    def __init__(self):
+        self.request_id = None
+        self.response_received = False
+
+    def __call__(self, driver):
+        for entry in driver.get_log("performance"):
+            message = json.loads(entry["message"])["message"]
+            method = message["method"]
+            params = message.get("params", {})
+
+            if method == "Network.requestWillBeSent" and \
+                    params.get("type") == "Document" and \
+                    params["request"]["method"] == "POST":
+                self.request_id = params["requestId"]
+
+            elif method == "Network.responseReceived" and \
+                    params.get("requestId") == self.request_id:
+                self.response_received = True
+
+            elif method == "Page.domContentEventFired" and \
+                    self.response_received:
+                return True
+
+        return False
+
+
 class element_inner_html_has_changed(object):
   """
   An expectation for checking if the inner html of an element has changed
@@ -1,5 +1,20 @@
+from .catalog import DEFAULT_CATALOG, resolve_course_url
+from .errors import CourseIdNotListed
+
+
 class Course:
     def __init__(self, id, url, password=None):
         self.id = str(id)
         self.url = url
-        self.password = password
\ No newline at end of file
+        self.password = password
+
+    @classmethod
+    def from_id(cls, id, password=None, catalog=None):
+        """
+        Course with the offer page URL looked up in the course catalog
+        (see hsp.catalog), catalog: path of the catalog database
+        """
+        url = resolve_course_url(id, catalog or DEFAULT_CATALOG)
+        if url is None:
+            raise CourseIdNotListed(id)
+        return cls(id, url, password)
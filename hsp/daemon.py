@@ -0,0 +1,393 @@
+import itertools
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from .bot import book_course
+from .course import Course
+from .errors import Error
+from .scraping import PageCache, new_session
+from .status import check_status, parse_target
+
+
+# Long running booking process. Credentials are parsed once, the offer
+# pages are loaded on one warm connection pool, and booking and status
+# jobs are accepted over a JSON API on the loopback interface:
+#
+#   POST   /jobs        queue a job, see Job for the fields
+#   GET    /jobs        state of all jobs
+#   GET    /jobs/<id>   state of one job
+#   DELETE /jobs/<id>   cancel a job that has not started yet
+#   GET    /health      accounts and number of jobs
+
+
+# time between the window opening and giving up, like bin/booking_bot.py
+DEFAULT_CUTOFF = timedelta(minutes=3)
+DEFAULT_WARM_UP = 60
+
+
+def parse_moment(value):
+    """
+    Timezone aware datetime of an ISO 8601 string, local time if no
+    timezone is given
+    """
+    if value is None:
+        return None
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.astimezone()
+    return moment
+
+
+class Job:
+    """
+    kind: "booking" or "status"
+    Booking jobs: course (id, or {"id", "url", "password"}), account,
+    start (ISO 8601, when the window opens; now if not given), cutoff
+    (default 3 minutes after start), warm_up (seconds before start to
+    launch the browser, 0 for none), test, mode.
+    Status jobs: courses, a list of targets as for 'hsp course-status'.
+    state: scheduled, warming (the browser is warmed up for the window),
+           running, done, failed or cancelled. Jobs can be cancelled until
+           they are running.
+    """
+
+    def __init__(self, id, kind, spec):
+        self.id = id
+        self.kind = kind
+        self.spec = spec
+        self.state = "scheduled"
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancelled = threading.Event()
+
+    def to_dict(self):
+        return {"id": self.id, "kind": self.kind, "spec": self.spec,
+                "state": self.state, "result": self.result,
+                "error": self.error, "created": self.created,
+                "started": self.started, "finished": self.finished}
+
+
+class DriverPool:
+    """
+    Browsers lent to the booking jobs. A browser given back after a
+    successful job is kept open for the next one, up to size of them;
+    the others are quit, so no browser outlives its job unnoticed.
+    """
+
+    def __init__(self, start_driver, size=2):
+        self.start_driver = start_driver
+        self.size = size
+        self.idle = []
+        self.lent = []
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            driver = self.idle.pop() if self.idle else None
+        if driver is None:
+            driver = self.start_driver()
+        with self.lock:
+            self.lent.append(driver)
+        return driver
+
+    def release(self, driver, reuse=True):
+        with self.lock:
+            if driver in self.lent:
+                self.lent.remove(driver)
+            keep = reuse and len(self.idle) < self.size
+        if keep and _reset_browser(driver):
+            with self.lock:
+                self.idle.append(driver)
+        else:
+            _quit(driver)
+
+    def close(self):
+        """
+        Quit all browsers, idle and lent
+        """
+        with self.lock:
+            drivers = self.idle + self.lent
+            self.idle, self.lent = [], []
+        for driver in drivers:
+            _quit(driver)
+
+
+def _reset_browser(driver):
+    # one tab and no login of the last job's account left for the next
+    # job, which may book for another account; False if the browser is
+    # gone
+    try:
+        handles = driver.window_handles
+        for handle in handles[1:]:
+            driver.switch_to.window(handle)
+            driver.close()
+        driver.switch_to.window(handles[0])
+        driver.delete_all_cookies()
+        if hasattr(driver, "execute_cdp_cmd"):
+            # the cookies of all sites, not only of the current page
+            driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        driver.execute_script("window.localStorage.clear();"
+                              "window.sessionStorage.clear();")
+        return True
+    except Exception as e:
+        print("[!] Browser is not reusable: {}".format(e))
+        return False
+
+
+def _quit(driver):
+    try:
+        driver.quit()
+    except Exception as e:
+        print("[!] Quitting the browser failed: {}".format(e))
+
+
+class BookingDaemon:
+    """
+    Runs the jobs, each in its own thread that sleeps until its window.
+    accounts: list of (account, Credentials), see hsp.accounts
+    drivers: number of browsers kept open between booking jobs, see
+             DriverPool
+    kwargs are passed to book_with_retry for every booking job
+    (e.g. backend, mode, metadata, cookie_store).
+    """
+
+    def __init__(self, accounts, start_driver, catalog=None, drivers=2,
+                 **kwargs):
+        self.accounts = dict(accounts)
+        self.start_driver = start_driver
+        self.drivers = DriverPool(start_driver, drivers)
+        self.catalog = catalog
+        self.kwargs = kwargs
+        # warm connection pool for the status checks and polls; jobs on
+        # the same offer page share its loads
+        self.session = new_session(pool_size=16)
+        self.pages = PageCache(self.session)
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def _course(self, spec):
+        if isinstance(spec, dict):
+            if spec.get("url"):
+                return Course(spec["id"], spec["url"], spec.get("password"))
+            return Course.from_id(spec["id"], spec.get("password"),
+                                  self.catalog)
+        return Course.from_id(spec, catalog=self.catalog)
+
+    def submit(self, spec):
+        """
+        Validate and queue a job, raises ValueError for invalid jobs
+        """
+        kind = spec.get("kind", "booking")
+        if kind == "booking":
+            if "course" not in spec:
+                raise ValueError("Booking jobs need a course")
+            account = spec.get("account")
+            if account is None and len(self.accounts) == 1:
+                account = next(iter(self.accounts))
+            if account not in self.accounts:
+                raise ValueError("Unknown account: {}".format(account))
+            spec = dict(spec, account=account)
+            parse_moment(spec.get("start"))
+            parse_moment(spec.get("cutoff"))
+        elif kind == "status":
+            if not spec.get("courses"):
+                raise ValueError("Status jobs need courses")
+        else:
+            raise ValueError("Unknown job kind: {}".format(kind))
+
+        job = Job(str(next(self._ids)), kind, spec)
+        with self.lock:
+            self.jobs[job.id] = job
+        target = self._run_booking if kind == "booking" else self._run_status
+        threading.Thread(target=target, args=(job,), daemon=True).start()
+        return job
+
+    def cancel(self, job_id):
+        """
+        Cancel a job that is not running yet, returns whether it was
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.state not in ("scheduled", "warming"):
+                return False
+            job.cancelled.set()
+            job.state = "cancelled"
+            job.finished = time.time()
+        return True
+
+    def _begin(self, job, state):
+        # moves the job on unless it was cancelled, under the lock cancel()
+        # checks the state with
+        with self.lock:
+            if job.cancelled.is_set():
+                return False
+            job.state = state
+            if job.started is None:
+                job.started = time.time()
+            return True
+
+    def close(self):
+        """
+        Cancel the scheduled jobs and quit the browsers
+        """
+        for job_id in list(self.jobs):
+            self.cancel(job_id)
+        self.drivers.close()
+
+    def _wait_until(self, job, moment):
+        # False if the job was cancelled while waiting
+        remaining = (moment - datetime.now(moment.tzinfo)).total_seconds()
+        return not job.cancelled.wait(max(0, remaining))
+
+    def _run_booking(self, job):
+        spec = job.spec
+        # browsers are only borrowed once the job needs one
+        lent = []
+
+        def borrow_driver():
+            driver = self.drivers.acquire()
+            lent.append(driver)
+            return driver
+
+        try:
+            course = self._course(spec["course"])
+            credentials = self.accounts[spec["account"]]
+            start = parse_moment(spec.get("start"))
+            cutoff = parse_moment(spec.get("cutoff"))
+            kwargs = dict(self.kwargs)
+            kwargs.setdefault("pages", self.pages)
+            kwargs["test"] = bool(spec.get("test", False))
+            if spec.get("mode"):
+                kwargs["mode"] = spec["mode"]
+            # tickets of several accounts must not overwrite each other
+            kwargs["confirmation_file"] = \
+                "booking_confirmation_{}_{}.html".format(
+                    spec["account"], course.id)
+
+            if start is not None:
+                kwargs["booking_cutoff"] = cutoff or start + DEFAULT_CUTOFF
+                warm = spec.get("warm_up", DEFAULT_WARM_UP)
+                if warm:
+                    kwargs["warm_until"] = start
+                    begin = start - timedelta(seconds=warm)
+                else:
+                    begin = start
+                if not self._wait_until(job, begin):
+                    return
+            else:
+                kwargs["fire"] = True
+
+            warming = kwargs.get("warm_until") is not None
+            if not self._begin(job, "warming" if warming else "running"):
+                return
+            # the warm-up ends early on cancel, and the booking starts
+            # only if the job was not cancelled meanwhile
+            result = book_course(course, credentials, borrow_driver,
+                                 cancelled=job.cancelled,
+                                 on_start=partial(self._begin, job,
+                                                  "running"),
+                                 **kwargs)
+            if job.state == "cancelled":
+                return
+            job.result = {"booked": result.booked, "error": result.error,
+                          "duration": result.duration}
+            job.state = "done" if result.booked else "failed"
+            job.error = result.error
+        except Error as e:
+            job.state = "failed"
+            job.error = e.msg
+        except Exception as e:
+            job.state = "failed"
+            job.error = repr(e)
+        finally:
+            # a failed job's browser may be stuck on a form, it is quit
+            for driver in lent:
+                self.drivers.release(driver, reuse=job.state == "done")
+        job.finished = time.time()
+
+    def _run_status(self, job):
+        if not self._begin(job, "running"):
+            return
+        try:
+            targets = [parse_target(str(target), self.catalog)
+                       for target in job.spec["courses"]]
+            job.result = check_status(targets, session=self.session)
+            job.state = "done"
+        except Exception as e:
+            job.state = "failed"
+            job.error = repr(e)
+        job.finished = time.time()
+
+
+class DaemonHandler(BaseHTTPRequestHandler):
+
+    daemon = None  # set by make_server
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, data):
+        content = json.dumps(data).encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _job_id(self):
+        parts = urlsplit(self.path).path.strip("/").split("/")
+        if len(parts) == 2 and parts[0] == "jobs":
+            return parts[1]
+        return None
+
+    def do_GET(self):
+        path = urlsplit(self.path).path.rstrip("/")
+        if path == "/health":
+            return self._send(200, {"accounts": sorted(self.daemon.accounts),
+                                    "jobs": len(self.daemon.jobs)})
+        if path == "/jobs":
+            with self.daemon.lock:
+                jobs = [job.to_dict() for job in self.daemon.jobs.values()]
+            return self._send(200, jobs)
+        job = self.daemon.jobs.get(self._job_id())
+        if job is None:
+            return self._send(404, {"error": "No such job"})
+        self._send(200, job.to_dict())
+
+    def do_POST(self):
+        if urlsplit(self.path).path.rstrip("/") != "/jobs":
+            return self._send(404, {"error": "Not found"})
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            spec = json.loads(self.rfile.read(length).decode("utf8"))
+            if not isinstance(spec, dict):
+                raise ValueError("A job is a JSON object")
+            job = self.daemon.submit(spec)
+        except ValueError as e:
+            return self._send(400, {"error": str(e)})
+        self._send(201, job.to_dict())
+
+    def do_DELETE(self):
+        job_id = self._job_id()
+        if job_id not in self.daemon.jobs:
+            return self._send(404, {"error": "No such job"})
+        if not self.daemon.cancel(job_id):
+            return self._send(409, {"error": "Job already started"})
+        self._send(200, self.daemon.jobs[job_id].to_dict())
+
+
+def make_server(daemon, port=8765):
+    """
+    HTTP server for the job API, only reachable from this machine
+    """
+    handler = type("Handler", (DaemonHandler,), {"daemon": daemon})
+    return ThreadingHTTPServer(("127.0.0.1", port), handler)
@@ -0,0 +1,42 @@
+from importlib import import_module
+
+
+# Browser backends by name, as "module:function". The module (and with it
+# Selenium) is only imported once the backend is started, so commands
+# without a browser start quickly.
+DRIVER_FACTORIES = {
+    "firefox": "hsp.booking:start_firefox",
+    "headless-firefox": "hsp.booking:start_headless_firefox",
+    "chrome": "hsp.booking:start_chrome",
+    "headless-chrome": "hsp.booking:start_headless_chrome",
+    "edge": "hsp.booking:start_edge",
+}
+
+
+def register_driver_factory(name, factory):
+    """
+    Add a browser backend. factory: "module:function" of a function
+    taking the browser profile name and returning a webdriver
+    """
+    DRIVER_FACTORIES[name] = factory
+
+
+def get_driver_factory(name):
+    """
+    The start function of a browser backend, importing its module
+    """
+    try:
+        module, function = DRIVER_FACTORIES[name].split(":")
+    except KeyError:
+        raise ValueError("Unknown browser: {}. Choose one of {}".format(
+            name, ", ".join(sorted(DRIVER_FACTORIES))))
+    return getattr(import_module(module), function)
+
+
+def start_driver(name, profile="default"):
+    """
+    Start the browser backend name. Module level, so that
+    functools.partial(start_driver, name, profile) can be sent to worker
+    processes.
+    """
+    return get_driver_factory(name)(profile)
@@ -24,6 +24,13 @@ class CourseIdAmbiguous(Error):
         self.msg = "Course with ID {} is listed more than once.".format(course_id)
 
 
+class CatalogNotFound(Error):
+
+    def __init__(self, path):
+        self.msg = "No course catalog at {}. Run 'hsp crawl-catalog' " \
+            "first.".format(path)
+
+
 class CourseNotBookable(Error):
 
     def __init__(self, course_id, course_status):
@@ -48,6 +55,30 @@ class BookingFailed(Error):
     pass
 
 
+class BookingRefused(BookingFailed):
+    """ The server positively refused the booking, nothing was booked """
+
+    pass
+
+
+class BookingCancelled(Error):
+
+    def __init__(self, course_id):
+        self.msg = "Booking of course {} was cancelled".format(course_id)
+
+
+class LoginFailed(Error):
+
+    pass
+
+
+class HedgeCancelled(Error):
+
+    def __init__(self, hedge, winner):
+        self.msg = "Hedge {} cancelled before confirming, hedge {} " \
+            "already sent the confirmation".format(hedge, winner)
+
+
 class FirefoxBinaryError(Error):
     """ Exception to express an error with the firefox Binary """
 
@@ -0,0 +1,137 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+
+from .bot import BookingResult, book_with_retry
+from .errors import BookingRefused, Error, HedgeCancelled
+
+
+# Hedged booking: one course is booked by several independent sessions at
+# once, so a single slow response at the window opening doesn't cost the
+# place. All of them run up to the final confirmation, which only one at a
+# time may send. Once one confirmation went through, the other hedges are
+# cancelled before confirming, so the course is never booked twice.
+
+
+class ConfirmGate:
+    """
+    Shared by the hedges of one course. confirm(hedge) is entered around
+    the final confirmation; it raises HedgeCancelled once another hedge
+    has confirmed. Only a confirmation the server positively refused
+    (BookingRefused) lets the next hedge try; any other failure, even an
+    unreadable ticket, may have booked the course.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.winner = None
+        # hedge -> time.monotonic() it reached the final confirmation
+        self.reached = {}
+
+    @contextmanager
+    def confirm(self, hedge):
+        self.reached[hedge] = time.monotonic()
+        with self.lock:
+            if self.winner is not None:
+                raise HedgeCancelled(hedge, self.winner)
+            try:
+                yield
+            except BookingRefused:
+                # refused by the server, the next hedge may try
+                raise
+            except BaseException:
+                # unknown outcome (e.g. a timeout or an unreadable ticket),
+                # it may have been booked
+                self.winner = hedge
+                raise
+            self.winner = hedge
+
+
+class HedgedResult(BookingResult):
+    """
+    BookingResult of a hedged booking.
+    winner: number of the hedge that booked the course
+    hedges: one dict per hedge with its outcome ("won", "cancelled" or
+            "failed"), error, time until it reached the confirmation
+            (confirm_at) and until it finished (duration), in seconds
+    spread: difference between the first and the last hedge reaching the
+            confirmation
+    """
+
+    def __init__(self, course_id, booked, error=None, duration=None,
+                 winner=None, hedges=None, spread=None):
+        super().__init__(course_id, booked, error, duration)
+        self.winner = winner
+        self.hedges = hedges or []
+        self.spread = spread
+
+    def __str__(self):
+        text = super().__str__()
+        if self.winner is not None:
+            text += " (hedge {} of {} won".format(self.winner,
+                                                  len(self.hedges))
+            if self.spread is not None:
+                text += ", spread {:.3f}s".format(self.spread)
+            text += ")"
+        return text
+
+
+def print_hedge_report(result):
+    for hedge in result.hedges:
+        line = "... hedge {}: {}".format(hedge["hedge"], hedge["outcome"])
+        if hedge["confirm_at"] is not None:
+            line += ", confirmation after {:.3f}s".format(hedge["confirm_at"])
+        line += ", done after {:.3f}s".format(hedge["duration"])
+        if hedge["outcome"] == "failed":
+            line += ": {}".format(hedge["error"])
+        print(line)
+
+
+def book_hedged(course, credentials, start_driver, hedges=3, **kwargs):
+    """
+    Book course with hedges independent sessions racing each other, each
+    in its own thread: HTTP sessions with mode="http", browsers started
+    with start_driver otherwise. kwargs are passed to book_with_retry.
+    Returns a HedgedResult.
+    """
+    gate = ConfirmGate()
+    start = time.monotonic()
+
+    def run(hedge):
+        try:
+            book_with_retry(course, credentials, start_driver,
+                            confirm_gate=partial(gate.confirm, hedge),
+                            **kwargs)
+        except HedgeCancelled as e:
+            outcome, error = "cancelled", e.msg
+        except Error as e:
+            outcome, error = "failed", e.msg
+        except Exception as e:
+            outcome, error = "failed", repr(e)
+        else:
+            outcome, error = "won", None
+        return {"hedge": hedge, "outcome": outcome, "error": error,
+                "duration": time.monotonic() - start}
+
+    with ThreadPoolExecutor(max_workers=hedges,
+                            thread_name_prefix="hsp-hedge") as pool:
+        reports = list(pool.map(run, range(1, hedges + 1)))
+
+    for report in reports:
+        reached = gate.reached.get(report["hedge"])
+        report["confirm_at"] = reached - start if reached else None
+    reached = [report["confirm_at"] for report in reports
+               if report["confirm_at"] is not None]
+    spread = max(reached) - min(reached) if reached else None
+
+    won = [report for report in reports if report["outcome"] == "won"]
+    if won:
+        return HedgedResult(course.id, True, duration=won[0]["duration"],
+                            winner=won[0]["hedge"], hedges=reports,
+                            spread=spread)
+    errors = [report["error"] for report in reports
+              if report["outcome"] == "failed"]
+    return HedgedResult(course.id, False, errors[0] if errors else None,
+                        hedges=reports, spread=spread)
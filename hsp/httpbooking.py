@@ -0,0 +1,250 @@
+from urllib.parse import urljoin, urlencode
+
+import requests
+
+from .agent import agent_fields
+from .errors import (BookingFailed, CourseNotBookable, InvalidCredentials,
+                     LoadingFailed)
+from .sessions import cookies_from_session, load_into_session
+from .scraping import (new_session, parse_offer_page, scrape_course,
+                       classify_booking_element)
+from .tickets import (Ticket, _text, find_refusal, parse_ticket,
+                      verify_ticket, write_confirmation)
+
+
+class BookingConfirmation:
+    """
+    The page the booking ended on.
+    confirmed: False if the final confirmation was skipped (test run)
+    details: label -> value of the two column rows on the ticket
+    ticket: hsp.tickets.Ticket with booking number, course id and price
+    """
+
+    def __init__(self, url, content, confirmed, details):
+        self.url = url
+        self.content = content
+        self.confirmed = confirmed
+        self.details = details
+        self.ticket = Ticket.from_details(details)
+
+    def save(self, outfile):
+        write_confirmation(self.content, outfile, self.url)
+
+
+class HTTPBooking:
+    """
+    Books a course without a browser, by replaying the form POSTs of the
+    booking flow on one keep-alive session. Hidden fields and tokens of
+    every form are carried over into the next request.
+
+    The flow is written as a generator of requests (see _steps), so the
+    same steps can be driven by an asynchronous transport.
+
+    cookie_store: hsp.sessions.CookieStore; the stored login of the account
+                  is reused and a new login is stored
+    confirm_gate: callable returning a context manager the final
+                  confirmation is sent in, see hsp.hedging
+    """
+
+    def __init__(self, course, session=None, timeout=20, cookie_store=None,
+                 confirm_gate=None):
+        self.course = course
+        # a session of its own, so cookies of parallel bookings don't mix
+        self.session = session or new_session()
+        self.timeout = timeout
+        self.cookie_store = cookie_store
+        self.confirm_gate = confirm_gate
+        self.url = None
+        self.content = None
+        self.document = None
+        self.encoding = None
+
+    def _load(self, url, content, encoding):
+        self.url = url
+        self.content = content
+        self.encoding = encoding or "utf-8"
+        self.document = parse_offer_page(content)
+
+    def _request(self, method, url, **kwargs):
+        try:
+            response = self.session.request(method, url,
+                                            timeout=self.timeout, **kwargs)
+            response.raise_for_status()
+        except requests.Timeout as e:
+            print(e)
+            raise LoadingFailed("Timeout while loading {}".format(url))
+        except requests.RequestException as e:
+            print(e)
+            raise LoadingFailed("Request for {} failed".format(url))
+        self._load(response.url, response.content, response.encoding)
+
+    def _find(self, xpath):
+        found = self.document.xpath(xpath)
+        return found[0] if found else None
+
+    def _submit(self, submitter, fields=()):
+        """
+        Request posting the form of the submit element with the given
+        (name, value) fields replacing the current values.
+        """
+        form = next(submitter.iterancestors("form"), None)
+        if form is None:
+            raise BookingFailed("Submit button outside of a form")
+
+        values = list(form.form_values())
+        for name, value in fields:
+            values = [(n, v) for n, v in values if n != name]
+            values.append((name, value))
+        if submitter.get("name"):
+            values.append((submitter.get("name"), submitter.get("value", "")))
+
+        action = urljoin(self.url, form.get("action") or self.url)
+        yield "POST", action, {
+            "data": urlencode(values, encoding=self.encoding),
+            "headers": {"Content-Type": "application/x-www-form-urlencoded",
+                        "Referer": self.url}}
+
+    def _field_name(self, key):
+        # keys starting with "#" address the field by its id
+        if not key.startswith("#"):
+            return key
+        element = self._find('//*[@id="{}"]'.format(key[1:]))
+        if element is None:
+            raise BookingFailed("Form field {} not found".format(key))
+        return element.get("name")
+
+    def _error_message(self, default):
+        error = self._find("//*[contains(@class, 'bs_text_red')]")
+        return _text(error) if error is not None else default
+
+    def _open_booking_form(self):
+        yield "GET", self.course.url, {}
+
+        scraped = scrape_course(self.document, self.course.id)
+        status, booking_possible, _ = classify_booking_element(
+            scraped["booking_tag"], scraped["booking_class"],
+            scraped["booking_text"])
+        if not booking_possible:
+            raise CourseNotBookable(self.course.id,
+                                    "Status: {}".format(status))
+
+        button = self._find("//a[@id='K{}']/following::*[1]".format(
+            self.course.id))
+        yield from self._submit(button)
+
+    def _enter_password(self):
+        password_xpath = "//input[@name='passwd']"
+        if self._find(password_xpath) is None:
+            return
+        if not self.course.password:
+            raise BookingFailed("Course {} requires a password".format(
+                self.course.id))
+
+        button = self._find("//input[@type='submit'][@value='weiter']")
+        yield from self._submit(button, [("passwd", self.course.password)])
+        if self._find(password_xpath) is not None:
+            raise BookingFailed("Course password was rejected")
+
+    def _login(self, credentials):
+        password_xpath = '//input[contains(@name, "pw_pwd_")]'
+        password_input = self._find(password_xpath)
+        if password_input is None:
+            raise BookingFailed("No login form on the booking page")
+
+        button = self._find(
+            "//input[@type='submit'][@value='weiter zur Buchung']")
+        yield from self._submit(button, [("pw_email", credentials.email),
+                                         (password_input.get("name"),
+                                          credentials.password)])
+        if self._find(password_xpath) is not None:
+            raise BookingFailed(self._error_message("Login failed"))
+        if self.cookie_store is not None:
+            self.cookie_store.put(credentials.email,
+                                  cookies_from_session(self.session))
+
+    def _logged_in(self):
+        # a stored session skips the login fields of the form
+        return self._find('//input[contains(@name, "pw_pwd_")]') is None
+
+    def _enter_personal_details(self, credentials, login):
+        fields = [(self._field_name(key), value)
+                  for key, value in agent_fields(credentials, login)]
+        eula = self._find('//input[@name="tnbed"]')
+        if eula is not None:
+            fields.append(("tnbed", eula.get("value", "on")))
+
+        button = self._find(
+            "//input[@type='submit'][@value='weiter zur Buchung']")
+        if button is None:
+            raise BookingFailed("No booking form on the booking page")
+        yield from self._submit(button, fields)
+        if self._find("//input[@type='checkbox'][@name='tnbed']") is not None:
+            raise BookingFailed(self._error_message("Form was rejected"))
+
+    def _confirm(self, email):
+        fields = []
+        check = self._find("//input[contains(@name, 'email_check_')]")
+        if check is not None:
+            fields.append((check.get("name"), email))
+
+        button = self._find("//input[@type='submit'][contains(@value, 'buchen')]")
+        if button is None:
+            raise BookingFailed("No confirmation form")
+        yield from self._submit(button, fields)
+
+        # booked only if the ticket has a booking number for this course
+        verify_ticket(Ticket.from_details(parse_ticket(self.document)),
+                      self.course.id, find_refusal(self.document))
+
+    def _steps(self, credentials, test):
+        """
+        Generator of (method, url, kwargs) requests. The caller performs
+        every request and _load()s the response before resuming.
+        Returns the BookingConfirmation.
+        """
+        if not credentials or not credentials.is_valid():
+            raise InvalidCredentials("Credentials are invalid")
+
+        login = bool(credentials.password)
+        if login and self.cookie_store is not None:
+            load_into_session(self.session,
+                              self.cookie_store.get(credentials.email))
+
+        yield from self._open_booking_form()
+
+        # password protected courses ask for it before the form
+        yield from self._enter_password()
+
+        if login and not self._logged_in():
+            yield from self._login(credentials)
+
+        yield from self._enter_personal_details(credentials, login)
+
+        if self.confirm_gate is not None:
+            # hedged booking, only one of the hedges may confirm
+            with self.confirm_gate():
+                if not test:
+                    yield from self._confirm(credentials.email)
+        elif not test:
+            yield from self._confirm(credentials.email)
+
+        return BookingConfirmation(self.url, self.content, not test,
+                                   parse_ticket(self.document))
+
+    def book(self, credentials, test=False):
+        """
+        Runs the booking and returns the BookingConfirmation.
+        With test, the final confirmation is not sent.
+        """
+        steps = self._steps(credentials, test)
+        try:
+            method, url, kwargs = next(steps)
+            while True:
+                self._request(method, url, **kwargs)
+                method, url, kwargs = steps.send(None)
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            # a failed request leaves the steps suspended, e.g. inside the
+            # confirm gate of a hedged booking
+            steps.close()
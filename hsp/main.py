@@ -1,8 +1,14 @@
+import os
+from datetime import datetime, time
+from functools import partial
+
 from .credentials import Credentials
 from .cli import parse_args
-from .booking import (HSPCourse, start_firefox, start_headless_firefox,
-                      start_chrome, start_headless_chrome)
-from .errors import (InvalidCredentials, CourseNotBookable, CourseIdNotListed)
+from .errors import (InvalidCredentials, CourseNotBookable, CourseIdNotListed,
+                     CatalogNotFound, LoadingFailed)
+
+# The subcommands import what they need themselves, so that e.g.
+# check-credentials doesn't load Selenium or the HTTP stack.
 
 
 def parse_credentials(credfile):
@@ -13,49 +19,193 @@ def parse_credentials(credfile):
     return credentials
 
 
-def main():
+def parse_start_time(start):
+    """
+    Today's datetime (local timezone) for a HH:MM[:SS] string
+    """
+    now = datetime.now().astimezone()
+    return datetime.combine(now.date(), time.fromisoformat(start),
+                            tzinfo=now.tzinfo)
 
-    args = parse_args()
 
-    if args.subcommand == "check-credentials":
-        print("[*] HSP Credential-File Checking")
-        try:
-            credentials = parse_credentials(args.credentials)
-        except InvalidCredentials as e:
-            print(e)
-            print("[!] INVALID CREDENTIALS")
-        else:
-            print("Credentials are most likely O.K. :)")
+def print_catalog_row(row):
+    print("... #{}: {} {}, {} {}, {} [{}]".format(
+        row["id"], row["sport"] or "", row["level"] or "",
+        row["weekday"] or "", row["time"] or "", row["location"] or "",
+        row["status"] or ""))
+
+
+def browser_name(args):
+    """
+    Registry name (see hsp.drivers) of the browser selected on the
+    command line
+    """
+    if args.use_firefox:
+        return "firefox"
+    elif args.use_headless_firefox:
+        return "headless-firefox"
+    elif args.use_chrome:
+        return "chrome"
+    return "headless-chrome"
+
+
+def driver_factory(args):
+    """
+    Function starting the browser selected on the command line
+    """
+    from .drivers import start_driver
+    return partial(start_driver, browser_name(args), args.profile)
+
 
+def check_credentials(args):
+    print("[*] HSP Credential-File Checking")
+    try:
+        parse_credentials(args.credentials)
+    except InvalidCredentials as e:
+        print(e)
+        print("[!] INVALID CREDENTIALS")
     else:
-        if args.use_firefox:
-            driver = start_firefox()
-        elif args.use_headless_firefox:
-            driver = start_headless_firefox()
-        elif args.use_chrome:
-            driver = start_chrome()
-        else:
-            driver = start_headless_chrome()
+        print("Credentials are most likely O.K. :)")
 
+
+def crawl_catalog(args):
+    from .catalog import DEFAULT_CATALOG, DEFAULT_INDEX_URL, crawl
+
+    print("[*] HSP Course Catalog")
+    catalog = args.catalog or DEFAULT_CATALOG
+    try:
+        count = crawl(args.index or DEFAULT_INDEX_URL, catalog, args.workers)
+    except LoadingFailed as e:
+        print("[ERROR] " + e.msg)
+        exit(1)
+    print("... {} courses indexed in {}".format(count, catalog))
+
+
+def find_course(args):
+    from .catalog import CourseCatalog, DEFAULT_CATALOG
+
+    catalog = args.catalog or DEFAULT_CATALOG
+    if not os.path.exists(catalog):
+        print("[ERROR] " + CatalogNotFound(catalog).msg)
+        exit(1)
+    with CourseCatalog(catalog) as index:
         try:
-            course = HSPCourse("12232856", "https://buchung.hsz.rwth-aachen.de/angebote/Wintersemester_2022_23/_Floorball_Spielbetrieb.html", driver)
-        except CourseIdNotListed:
-            print("[ERROR] Course ID not listed")
+            rows = index.query(args.sport, args.weekday, args.after,
+                               args.before)
+        except ValueError as e:
+            print("[ERROR] {}".format(e))
             exit(1)
+    for row in rows:
+        print_catalog_row(row)
+    print("... {} courses found".format(len(rows)))
+
+
+def run_daemon(args):
+    from .accounts import load_accounts
+    from .daemon import BookingDaemon, make_server
+    from .sessions import CookieStore
+
+    accounts = load_accounts(args.accounts)
+    if not accounts:
+        print("[ERROR] No valid credentials")
+        exit(1)
+    kwargs = {}
+    if args.http_booking:
+        kwargs["mode"] = "http"
+    if args.keep_login:
+        kwargs["cookie_store"] = CookieStore()
+    daemon = BookingDaemon(accounts, driver_factory(args), args.catalog,
+                           drivers=args.browsers, **kwargs)
+    server = make_server(daemon, args.port)
+    print("[*] HSP booking daemon for {}".format(
+        ", ".join(name for name, _ in accounts)))
+    print("... jobs at http://127.0.0.1:{}/jobs".format(args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("[*] Stopped")
+    finally:
+        server.server_close()
+        daemon.close()
+
 
-        if args.subcommand == "course-status":
-                print("[*] HSP Course Status")
-                print("... " + course.info())
-                print("... " + course.status())
-
-        elif args.subcommand == "booking":
-            print("[*] HSP Course Booking")
-            credentials = parse_credentials(args.credentials)
-            print("... " + course.info())
-            try: course.book(credentials)
-            except CourseNotBookable:
-                print("... " + course.status())
-                print("[ERROR] Course cannot be booked")
+def course_status(args):
+    from .status import (check_status, format_rows, load_job_file,
+                         parse_target)
+
+    jobs = [parse_target(target, args.catalog) for target in args.course]
+    if args.jobs:
+        try:
+            jobs += load_job_file(args.jobs, args.catalog)
+        except (OSError, ValueError) as e:
+            print("[ERROR] {}".format(e))
+            exit(1)
+    rows = check_status(jobs, args.workers)
+    print(format_rows(rows, args.output))
+    # non-zero for cron, if any course could not be checked
+    if any(row["error"] is not None for row in rows):
+        exit(1)
+
+
+def booking(args):
+    from .course import Course
+
+    try:
+        course = Course.from_id(args.course, catalog=args.catalog)
+    except (CourseIdNotListed, CatalogNotFound) as e:
+        print("[ERROR] " + e.msg)
+        exit(1)
+
+    # Selenium only once the course is known
+    from .booking import HSPCourse
+    from .bot import wait_until
+    from .warmup import keep_warm
+
+    start = None
+    if args.start:
+        start = parse_start_time(args.start)
+        print("[*] Booking window opens at {}".format(start))
+        # without warm-up, the browser is only started at the opening
+        if not args.warm_up:
+            wait_until(start)
+
+    driver = driver_factory(args)()
+
+    try:
+        course = HSPCourse(course, driver)
+    except CourseIdNotListed:
+        print("[ERROR] Course ID not listed")
+        exit(1)
+
+    print("[*] HSP Course Booking")
+    credentials = parse_credentials(args.credentials)
+    print("... " + course.info())
+    if start is not None and args.warm_up:
+        # the course page is loaded, keep the session alive
+        keep_warm([course], start)
+        course.refresh()
+    mode = "agent" if args.agent else "keys"
+    try: course.book(credentials, confirmation_file=args.booking_out,
+                     mode=mode)
+    except CourseNotBookable:
+        print("... " + course.status())
+        print("[ERROR] Course cannot be booked")
+
+
+SUBCOMMANDS = {
+    "check-credentials": check_credentials,
+    "crawl-catalog": crawl_catalog,
+    "find-course": find_course,
+    "daemon": run_daemon,
+    "course-status": course_status,
+    "booking": booking,
+}
+
+
+def main():
+
+    args = parse_args()
+    SUBCOMMANDS[args.subcommand](args)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,120 @@
+import os
+import time
+
+from selenium.common.exceptions import WebDriverException
+
+
+def _children(pid):
+    # pids of the direct children, from /proc (Linux only); every thread
+    # lists the children it started
+    children = []
+    try:
+        tasks = os.listdir("/proc/{}/task".format(pid))
+    except OSError:
+        return children
+    for task in tasks:
+        try:
+            with open("/proc/{}/task/{}/children".format(pid, task)) as f:
+                children.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return children
+
+
+def _rss(pid):
+    try:
+        with open("/proc/{}/status".format(pid)) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def process_tree_rss(pid):
+    """
+    Resident memory in bytes of a process and all of its descendants,
+    None where /proc is not available
+    """
+    if not os.path.exists("/proc/{}".format(pid)):
+        return None
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        total += _rss(current)
+        pending.extend(_children(current))
+    return total
+
+
+def driver_memory(driver):
+    """
+    Open windows, resident memory of the driver with its browser and
+    renderer processes (MB), and the JS heap of the current page (MB,
+    Chromium only). Unknown values are None.
+    """
+    usage = {"windows": None, "rss_mb": None, "js_heap_mb": None}
+    try:
+        usage["windows"] = len(driver.window_handles)
+        heap = driver.execute_script(
+            "return window.performance && performance.memory ? "
+            "performance.memory.usedJSHeapSize : null;")
+        if heap is not None:
+            usage["js_heap_mb"] = round(heap / 2**20, 1)
+    except WebDriverException:
+        pass
+
+    service = getattr(driver, "service", None)
+    process = getattr(service, "process", None)
+    if process is not None:
+        rss = process_tree_rss(process.pid)
+        if rss is not None:
+            usage["rss_mb"] = round(rss / 2**20, 1)
+    return usage
+
+
+class MemoryMonitor:
+    """
+    Samples driver_memory at most every interval seconds, so a watch over
+    hours can be checked for growing memory and window counts.
+    tracer: hsp.tracing.Tracer the samples are also recorded in, as
+            counters
+    """
+
+    def __init__(self, interval=60, tracer=None):
+        self.interval = interval
+        self.tracer = tracer
+        self.samples = []
+        self._last = None
+
+    def sample(self, driver, force=False):
+        now = time.monotonic()
+        if not force and self._last is not None and \
+                now - self._last < self.interval:
+            return None
+        self._last = now
+        usage = driver_memory(driver)
+        usage["time"] = time.time()
+        self.samples.append(usage)
+        if self.tracer is not None:
+            self.tracer.counter("browser memory", rss_mb=usage["rss_mb"],
+                                js_heap_mb=usage["js_heap_mb"],
+                                windows=usage["windows"])
+        return usage
+
+    def report(self):
+        if not self.samples:
+            print("[*] No memory samples")
+            return
+        first, last = self.samples[0], self.samples[-1]
+        hours = (last["time"] - first["time"]) / 3600
+        print("[*] Browser memory over {:.1f}h, {} samples".format(
+            hours, len(self.samples)))
+        for key, unit in (("rss_mb", " MB"), ("js_heap_mb", " MB"),
+                          ("windows", "")):
+            values = [s[key] for s in self.samples if s[key] is not None]
+            if not values:
+                continue
+            print("... {}: first {}{unit}, last {}{unit}, peak {}{unit}".format(
+                key, values[0], values[-1], max(values), unit=unit))
@@ -0,0 +1,109 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+DEFAULT_METADATA = os.path.join(os.path.expanduser("~"), ".hsp",
+                                "metadata.db")
+# details of a course don't change within a semester
+DEFAULT_TTL = 7 * 24 * 3600
+
+FIELDS = ("time", "weekday", "location", "level", "course_name")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (
+    id TEXT NOT NULL,
+    url TEXT NOT NULL,
+    time TEXT,
+    weekday TEXT,
+    location TEXT,
+    level TEXT,
+    course_name TEXT,
+    cached_at REAL NOT NULL,
+    PRIMARY KEY (id, url)
+);
+"""
+
+
+class MetadataCache:
+    """
+    On-disk cache of the static details of courses (time, weekday,
+    location, level and name), keyed by course id and offer page URL.
+    Only the booking status has to be read live once a course is cached.
+    ttl: seconds an entry is served, None to keep entries until they are
+         invalidated
+    """
+
+    def __init__(self, path=DEFAULT_METADATA, ttl=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # bookings in threads share the cache, one statement at a time
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    # worker processes reopen the database
+    def __getstate__(self):
+        return {"path": self.path, "ttl": self.ttl}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, course):
+        """
+        The cached details of a course as a dict, None if there are none
+        or they have expired
+        """
+        with self.lock:
+            row = self.db.execute(
+                "SELECT {}, cached_at FROM metadata WHERE id = ? AND url = ?"
+                .format(", ".join(FIELDS)), (course.id, course.url)).fetchone()
+        if row is None:
+            return None
+        if self.ttl is not None and time.time() - row[-1] > self.ttl:
+            return None
+        return dict(zip(FIELDS, row))
+
+    def put(self, course, details):
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO metadata (id, url, {}, cached_at) "
+                "VALUES (?, ?, {}, ?)".format(", ".join(FIELDS),
+                                              ", ".join("?" * len(FIELDS))),
+                (course.id, course.url) +
+                tuple(details[field] for field in FIELDS) + (time.time(),))
+
+    def invalidate(self, course=None):
+        """
+        Drop the cached details of a course, or of all courses
+        """
+        with self.lock, self.db:
+            if course is None:
+                self.db.execute("DELETE FROM metadata")
+            else:
+                self.db.execute("DELETE FROM metadata WHERE id = ? AND url = ?",
+                                (course.id, course.url))
+
+    def prune(self):
+        """
+        Drop all expired entries
+        """
+        if self.ttl is None:
+            return
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM metadata WHERE cached_at < ?",
+                            (time.time() - self.ttl,))
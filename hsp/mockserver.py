@@ -0,0 +1,460 @@
+import argparse
+import html
+import secrets
+import threading
+import time
+from datetime import datetime
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+# Local stand-in for buchung.hsz.rwth-aachen.de.
+# Serves offer pages and the booking form pages in the structure the
+# scrapers and booking engines expect, so they can be run offline.
+#
+#   python -m hsp.mockserver --port 8080
+
+
+OFFER_PATH = "/angebote/Sommersemester/{}.html"
+INDEX_PATH = "/angebote/Sommersemester/index.html"
+BOOKING_PATH = "/cgi/anmeldung.fcgi"
+LOGIN_PATH = "/cgi/konto.fcgi"
+SESSION_COOKIE = "bs_session"
+
+
+class MockCourse:
+    """
+    state: "bookable", "waitinglist" or the status text of a closed course
+           such as "ausgebucht". Bookable courses show a countdown until the
+           MockHSZ opens.
+    """
+
+    def __init__(self, id, page="_Floorball_Spielbetrieb", level="Level 1",
+                 weekday="Mo", time="18:00-19:30", location="Halle 1",
+                 state="bookable", password=None, price="15/ 30 EUR"):
+        self.id = str(id)
+        self.page = page
+        self.level = level
+        self.weekday = weekday
+        self.time = time
+        self.location = location
+        self.state = state
+        self.password = password
+        self.price = price
+        self.bookings = []
+
+
+class MockHSZ:
+    """
+    Booking system state shared by all request handlers
+    latency: seconds every response is delayed
+    opens_at: time.time() timestamp at which bookable courses open,
+              None if they are open right away
+    session_ttl: seconds a login session cookie stays valid
+    refusals: number of final confirmations refused before the next one
+              is booked, e.g. for a course booked out in the meantime
+    """
+
+    def __init__(self, courses, accounts=None, latency=0, opens_at=None,
+                 session_ttl=3600, refusals=0):
+        self.courses = {course.id: course for course in courses}
+        self.latency = latency
+        self.opens_at = opens_at
+        # email -> password, for the pw_email / pw_pwd_ login
+        self.accounts = accounts or {}
+        self.session_ttl = session_ttl
+        self.refusals = refusals
+        self.sessions = {}  # session cookie -> (email, expires at)
+        self.forms = {}  # fid -> course id
+        self.submitted = {}  # fid -> personal data waiting for confirmation
+        self.lock = threading.Lock()
+
+    def is_open(self):
+        return self.opens_at is None or time.time() >= self.opens_at
+
+    def state(self, course):
+        if course.state == "bookable" and not self.is_open():
+            return "countdown"
+        return course.state
+
+    def check_login(self, email, password):
+        return email in self.accounts and self.accounts[email] == password
+
+    def new_session(self, email):
+        token = secrets.token_hex(16)
+        with self.lock:
+            self.sessions[token] = (email, time.time() + self.session_ttl)
+        return token
+
+    def session_email(self, token):
+        email, expires_at = self.sessions.get(token, (None, 0))
+        return email if time.time() < expires_at else None
+
+    def pages(self):
+        return sorted(set(course.page for course in self.courses.values()))
+
+    def offer_url(self, base_url, page):
+        return base_url + OFFER_PATH.format(page)
+
+    def index_url(self, base_url):
+        return base_url + INDEX_PATH
+
+
+def _page(title, body):
+    return ("<!DOCTYPE html><html><head><meta charset='utf-8'>"
+            "<title>{}</title></head><body>{}</body></html>").format(
+                html.escape(title), body)
+
+
+def render_offer_page(hsz, page):
+    rows = []
+    for course in hsz.courses.values():
+        if course.page != page:
+            continue
+        state = hsz.state(course)
+        if state == "countdown":
+            opens = datetime.fromtimestamp(hsz.opens_at)
+            button = ("<span class='bs_btn_autostart'>ab {}</span>"
+                      "<span class='bs_countdown'>{}</span>").format(
+                          opens.strftime("%d.%m., %H:%M"),
+                          int(hsz.opens_at - time.time()))
+        elif state == "bookable":
+            button = ("<input type='submit' value='buchen' "
+                      "class='bs_btn_buchen' name='BS_Kursid_{}'>").format(
+                          course.id)
+        elif state == "waitinglist":
+            button = ("<input type='submit' value='Warteliste' "
+                      "class='bs_btn_warteliste' name='BS_Kursid_{}'>").format(
+                          course.id)
+        else:
+            button = "<span class='bs_btn_ausgebucht'>{}</span>".format(
+                html.escape(state))
+        rows.append(
+            "<tr class='bs_odd'><td class='bs_sknr'>{}</td>"
+            "<td class='bs_sdet'>{}</td><td class='bs_stag'>{}</td>"
+            "<td class='bs_szeit'>{}</td><td class='bs_sort'>{}</td>"
+            "<td class='bs_spreis'>{}</td>"
+            "<td class='bs_sbuch'><a id='K{}'></a>{}</td></tr>".format(
+                course.id, html.escape(course.level),
+                html.escape(course.weekday), html.escape(course.time),
+                html.escape(course.location), html.escape(course.price),
+                course.id, button))
+
+    body = ("<div class='bs_head'>{}</div>"
+            "<form action='{}' method='post' target='_blank'>"
+            "<input type='hidden' name='BS_Code' value='mock'>"
+            "<table class='bs_kurse'><tbody>{}</tbody></table>"
+            "</form>").format(html.escape(page.strip("_").replace("_", " ")),
+                              BOOKING_PATH, "".join(rows))
+    return _page(page, body)
+
+
+def render_index_page(hsz):
+    links = "".join("<dd><a href='{}.html'>{}</a></dd>".format(
+        page, html.escape(page.strip("_").replace("_", " ")))
+        for page in hsz.pages())
+    body = ("<div class='bs_head'>Sportangebote</div>"
+            "<div id='bs_content'><dl class='bs_menu'>{}</dl></div>"
+            "<a href='/cgi/webpage.cgi?kurse'>Kursübersicht</a>").format(links)
+    return _page("Sportangebote", body)
+
+
+def render_login_page(email=None, error=None):
+    if email is not None:
+        body = ("<div class='bs_head'>Kundenkonto</div>"
+                "<div id='bs_angemeldet'>{}</div>").format(html.escape(email))
+    else:
+        body = ("{}<form action='{}' method='post'>"
+                "<input type='text' name='pw_email'>"
+                "<input type='password' name='pw_pwd_konto'>"
+                "<input type='submit' value='anmelden'>"
+                "</form>").format(
+                    "<div class='bs_text_red'>{}</div>".format(
+                        html.escape(error)) if error else "",
+                    LOGIN_PATH)
+    return _page("Kundenkonto", body)
+
+
+def _account_prefill(email):
+    return {"vorname": "Max", "name": "Mustermann", "sex": "M",
+            "email": email, "statusorig": "S-RWTH",
+            "matnr": "331898", "telefon": "0123456789"}
+
+
+def render_password_form(fid):
+    body = ("<form name='bs_form_main' action='{}' method='post'>"
+            "<input type='hidden' name='fid' value='{}'>"
+            "<input class='bs_form_field' type='password' name='passwd'>"
+            "<input type='submit' value='weiter'>"
+            "</form>").format(BOOKING_PATH, fid)
+    return _page("Kurspasswort", body)
+
+
+def render_personal_form(fid, prefill=None, error=None, logged_in=False):
+    prefill = prefill or {}
+    login = ("<div id='bs_pw_anmlink'>Anmelden</div>"
+             "<input type='text' name='pw_email'>"
+             "<input type='password' name='pw_pwd_{}'>").format(fid)
+
+    def value(name):
+        return html.escape(prefill.get(name, ""), quote=True)
+
+    statuses = ("S-RWTH", "S-aH", "B-UNIT", "B-UKT", "B-aH", "Extern")
+    options = "".join("<option value='{0}'{1}>{0}</option>".format(
+        status, " selected" if prefill.get("statusorig") == status else "")
+        for status in statuses)
+    body = (
+        "{error}"
+        "<form name='bs_form_main' action='{action}' method='post'>"
+        "<input type='hidden' name='fid' value='{fid}'>"
+        "{login}"
+        "<input type='radio' name='sex' value='M'{male}>"
+        "<input type='radio' name='sex' value='W'{female}>"
+        "<input id='BS_F1100' name='vorname' value='{vorname}'>"
+        "<input id='BS_F1200' name='name' value='{name}'>"
+        "<input id='BS_F1300' name='strasse' value='{strasse}'>"
+        "<input id='BS_F1400' name='ort' value='{ort}'>"
+        "<select id='BS_F1600' name='statusorig'>"
+        "<option value=''>-</option>{options}</select>"
+        "<input id='BS_F1700' name='matnr' value='{matnr}'>"
+        "<input id='BS_F1700' name='mitnr' value='{mitnr}'>"
+        "<input id='BS_F2000' name='email' value='{email}'>"
+        "<input id='BS_F2100' name='telefon' value='{telefon}'>"
+        "<input id='BS_F_iban' name='iban' value='{iban}'>"
+        "<input type='checkbox' name='tnbed' value='1'>"
+        "<div id='bs_counter'>5</div>"
+        "<div id='bs_submit' class='hidden'>"
+        "<input type='submit' value='weiter zur Buchung'></div>"
+        "</form>").format(
+            error="<div class='bs_text_red'>{}</div>".format(
+                html.escape(error)) if error else "",
+            action=BOOKING_PATH, fid=fid, options=options,
+            login="" if logged_in else login,
+            male=" checked" if prefill.get("sex") == "M" else "",
+            female=" checked" if prefill.get("sex") == "W" else "",
+            vorname=value("vorname"), name=value("name"),
+            strasse=value("strasse"), ort=value("ort"),
+            matnr=value("matnr"), mitnr=value("mitnr"),
+            email=value("email"), telefon=value("telefon"),
+            iban=value("iban"))
+    return _page("Anmeldung", body)
+
+
+def render_confirm_page(fid):
+    body = ("<div class='bs_text_red bs_text_big'>Bitte bestätigen</div>"
+            "<form name='bs_form_main' action='{}' method='post'>"
+            "<input type='hidden' name='fid' value='{}'>"
+            "<input type='hidden' name='_formdata' value='{}'>"
+            "<input class='bs_form_field' name='email_check_{}'>"
+            "<input type='submit' value='verbindlich buchen'>"
+            "</form>").format(BOOKING_PATH, fid, secrets.token_hex(8), fid)
+    return _page("Bestätigung", body)
+
+
+def render_ticket(course, number, data):
+    body = ("<div class='bs_head'>Buchungsbestätigung</div>"
+            "<table class='bs_ticket'>"
+            "<tr><td>Buchungsnummer</td><td class='bs_ticket_nr'>{}</td></tr>"
+            "<tr><td>Kursnummer</td><td class='bs_ticket_kurs'>{}</td></tr>"
+            "<tr><td>Name</td><td>{} {}</td></tr>"
+            "<tr><td>Entgelt</td><td class='bs_ticket_preis'>{}</td></tr>"
+            "</table>").format(number, course.id,
+                               html.escape(data.get("vorname", "")),
+                               html.escape(data.get("name", "")),
+                               html.escape(course.price))
+    return _page("Buchungsbestätigung", body)
+
+
+class MockHSZHandler(BaseHTTPRequestHandler):
+
+    hsz = None  # set by make_server
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, session=None):
+        content = body.encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        if session is not None:
+            self.send_header("Set-Cookie", "{}={}; Path=/; HttpOnly".format(
+                SESSION_COOKIE, session))
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _delay(self):
+        if self.hsz.latency:
+            time.sleep(self.hsz.latency)
+
+    def do_HEAD(self):
+        self._delay()
+        self.send_response(200)
+        self.end_headers()
+
+    def do_GET(self):
+        self._delay()
+        path = urlsplit(self.path).path
+        if path == INDEX_PATH:
+            return self._send(200, render_index_page(self.hsz))
+        if path == LOGIN_PATH:
+            return self._send(200, render_login_page(self._logged_in()))
+        for page in self.hsz.pages():
+            if path == OFFER_PATH.format(page):
+                return self._send(200, render_offer_page(self.hsz, page))
+        self._send(404, _page("Not found", "Not found"))
+
+    def _logged_in(self):
+        # email of the session cookie, None without a valid session
+        cookie = SimpleCookie(self.headers.get("Cookie") or "")
+        if SESSION_COOKIE not in cookie:
+            return None
+        return self.hsz.session_email(cookie[SESSION_COOKIE].value)
+
+    def do_POST(self):
+        self._delay()
+        path = urlsplit(self.path).path
+        if path not in (BOOKING_PATH, LOGIN_PATH):
+            return self._send(404, _page("Not found", "Not found"))
+        length = int(self.headers.get("Content-Length") or 0)
+        data = dict(parse_qsl(self.rfile.read(length).decode("utf8"),
+                              keep_blank_values=True))
+        self.session = None
+        if path == LOGIN_PATH:
+            body = self._account_login(data)
+        else:
+            body = self._booking_step(data)
+        self._send(200, body, self.session)
+
+    def _account_login(self, data):
+        email = data.get("pw_email")
+        if not self.hsz.check_login(email, data.get("pw_pwd_konto")):
+            return render_login_page(error="Login fehlgeschlagen")
+        self.session = self.hsz.new_session(email)
+        return render_login_page(email)
+
+    def _personal_form(self, fid):
+        # logged in sessions get a prefilled form without the login fields
+        email = self._logged_in()
+        if email is not None:
+            return render_personal_form(fid, _account_prefill(email),
+                                        logged_in=True)
+        return render_personal_form(fid)
+
+    def _booking_step(self, data):
+        hsz = self.hsz
+
+        # booking button on the offer page
+        for key in data:
+            if key.startswith("BS_Kursid_"):
+                course = hsz.courses.get(key[len("BS_Kursid_"):])
+                if course is None or hsz.state(course) != "bookable":
+                    return _page("Fehler", "Kurs nicht buchbar")
+                fid = secrets.token_hex(8)
+                with hsz.lock:
+                    hsz.forms[fid] = course.id
+                if course.password:
+                    return render_password_form(fid)
+                return self._personal_form(fid)
+
+        fid = data.get("fid")
+        course = hsz.courses.get(hsz.forms.get(fid))
+        if course is None:
+            return _page("Fehler", "Sitzung abgelaufen")
+
+        if "passwd" in data:
+            if data["passwd"] != course.password:
+                return render_password_form(fid)
+            return self._personal_form(fid)
+
+        if data.get("pw_email") and "tnbed" not in data:
+            if not hsz.check_login(data["pw_email"],
+                                   data.get("pw_pwd_" + fid)):
+                return render_personal_form(fid, error="Login fehlgeschlagen")
+            self.session = hsz.new_session(data["pw_email"])
+            return render_personal_form(fid, _account_prefill(data["pw_email"]),
+                                        logged_in=True)
+
+        if "email_check_" + fid in data:
+            form = hsz.submitted.get(fid, {})
+            if data["email_check_" + fid] != form.get("email"):
+                return render_confirm_page(fid)
+            with hsz.lock:
+                if hsz.refusals > 0:
+                    hsz.refusals -= 1
+                    return _page("Fehler", "<div class='bs_text_red'>"
+                                 "Buchung nicht möglich</div>")
+                number = len(course.bookings) + 1
+                course.bookings.append(form)
+                del hsz.forms[fid]
+                del hsz.submitted[fid]
+            return render_ticket(course, number, form)
+
+        required = ("sex", "vorname", "name", "strasse", "ort", "email",
+                    "statusorig", "tnbed")
+        missing = [field for field in required if not data.get(field)]
+        if missing:
+            return render_personal_form(
+                fid, data, error="Bitte ausfüllen: " + ", ".join(missing))
+        with hsz.lock:
+            hsz.submitted[fid] = data
+        return render_confirm_page(fid)
+
+
+def make_server(hsz, host="127.0.0.1", port=0):
+    """
+    HTTP server for the MockHSZ, port 0 picks a free port
+    """
+    handler = type("Handler", (MockHSZHandler,), {"hsz": hsz})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def start_server(hsz, host="127.0.0.1", port=0):
+    """
+    Serve the MockHSZ in a background thread.
+    Returns the server and its base url.
+    """
+    server = make_server(hsz, host, port)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, "http://{}:{}".format(*server.server_address)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for the HSZ booking system",
+        prog="hsp-mockserver")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0,
+                        help="delay of every response in milliseconds")
+    parser.add_argument("--opens-in", type=float, default=None,
+                        help="seconds until bookable courses open")
+    args = parser.parse_args()
+
+    opens_at = None
+    if args.opens_in is not None:
+        opens_at = time.time() + args.opens_in
+
+    hsz = MockHSZ([
+        MockCourse("12231858"),
+        MockCourse("12231859", level="Level 2", weekday="Mi",
+                   state="waitinglist"),
+        MockCourse("12231860", level="Level 3", weekday="Fr",
+                   state="ausgebucht"),
+        MockCourse("15131246", page="_Softball_Level_2_-_3",
+                   password="password"),
+    ], accounts={"max.mustermann@mail.com": "password"},
+        latency=args.latency / 1000, opens_at=opens_at)
+    server = make_server(hsz, args.host, args.port)
+    base_url = "http://{}:{}".format(*server.server_address)
+    print("... serving " + hsz.index_url(base_url))
+    print("... account login at " + base_url + LOGIN_PATH)
+    for page in hsz.pages():
+        print("... serving " + hsz.offer_url(base_url, page))
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
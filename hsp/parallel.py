@@ -0,0 +1,74 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from .bot import book_course
+
+
+def book_parallel(courses, credentials, start_driver, max_workers=None,
+                  **kwargs):
+    """
+    Book every course in its own worker process with its own browser.
+    start_driver has to be a module level function (e.g. start_edge), so
+    it can be sent to the workers.
+    max_workers: by default one per course, so that all of them start
+                 when the window opens; the workers wait on the browser
+                 and the network, not the CPU
+    kwargs are passed to book_with_retry.
+    Returns the BookingResults in the order of courses.
+    """
+    if not courses:
+        return []
+    max_workers = max_workers or len(courses)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(book_course, course, credentials,
+                               start_driver, **kwargs)
+                   for course in courses]
+        results = [future.result() for future in futures]
+
+    # collect the spans recorded in the workers
+    tracer = kwargs.get("tracer")
+    if tracer is not None:
+        for result in results:
+            tracer.events.extend(result.trace_events or [])
+    return results
+
+
+def _book_for_account(account, course, credentials, start_driver, **kwargs):
+    # the tickets of different accounts must not overwrite each other
+    kwargs.setdefault("confirmation_file",
+                      "booking_confirmation_{}_{}.html".format(
+                          account, course.id))
+    result = book_course(course, credentials, start_driver, **kwargs)
+    result.account = account
+    return result
+
+
+def book_accounts_parallel(accounts, courses, start_driver, max_workers=None,
+                           **kwargs):
+    """
+    Book every course for every account at once. Each booking runs in its
+    own worker process with its own browser or HTTP session, so cookies
+    and logins of the accounts stay apart.
+    accounts: list of (account, Credentials), see hsp.accounts.load_accounts
+    max_workers: by default one per booking, so that all of them start
+                 when the window opens
+    kwargs are passed to book_with_retry.
+    Returns the BookingResults, grouped by account in the order of courses.
+    """
+    jobs = [(account, credentials, course)
+            for account, credentials in accounts for course in courses]
+    if not jobs:
+        return []
+    max_workers = max_workers or len(jobs)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(_book_for_account, account, course,
+                               credentials, start_driver, **kwargs)
+                   for account, credentials, course in jobs]
+        results = [future.result() for future in futures]
+
+    tracer = kwargs.get("tracer")
+    if tracer is not None:
+        for result in results:
+            tracer.events.extend(result.trace_events or [])
+    return results
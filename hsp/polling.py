@@ -0,0 +1,135 @@
+import bisect
+import random
+import threading
+import time
+from datetime import datetime
+
+
+class PollScheduler:
+    """
+    Decides when the watched courses are polled again while they are not
+    bookable yet, within one requests per second budget for all of them.
+
+    The interval of a course is min_interval within the fast window
+    around the expected opening (fast_before seconds before, fast_after
+    seconds after it) and grows by backoff seconds per second outside of
+    it, up to max_interval. It is stretched while the server responds
+    slower than it did at its fastest, and jittered, so the pollers don't
+    fire in lockstep. Without an expected opening, every course is polled
+    every interval seconds.
+
+    Polls of all courses are reserved at least 1 / rate seconds apart,
+    each in the first free slot after its interval. A course asks for its
+    next poll after its last one, so a saturated budget is shared round
+    robin.
+
+    expected_open: timezone aware datetime the window is expected to open
+    clock: hsp.clock.ServerClock to measure the time to the opening in
+           server time
+    """
+
+    def __init__(self, rate=4, expected_open=None, clock=None, interval=1,
+                 min_interval=0.25, max_interval=10, fast_before=5,
+                 fast_after=20, backoff=0.05, jitter=0.2, max_slowdown=4):
+        self.rate = rate
+        self.expected_open = expected_open
+        self.clock = clock
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.fast_before = fast_before
+        self.fast_after = fast_after
+        self.backoff = backoff
+        self.jitter = jitter
+        self.max_slowdown = max_slowdown
+        self.lock = threading.Lock()
+        self.slots = []  # time.monotonic() of the reserved polls, sorted
+        self.latency = None  # moving average of the response times
+        self.fastest = None
+
+    def __getstate__(self):
+        # sent to worker processes without the lock
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def share(self, parts):
+        """
+        Scheduler with the budget divided by parts, for each of as many
+        worker processes
+        """
+        scheduler = PollScheduler.__new__(PollScheduler)
+        scheduler.__setstate__(self.__getstate__())
+        scheduler.slots = []
+        scheduler.rate = self.rate / max(1, parts)
+        return scheduler
+
+    def record(self, latency):
+        """
+        Response time of a poll in seconds
+        """
+        with self.lock:
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency = 0.7 * self.latency + 0.3 * latency
+            if self.fastest is None or self.latency < self.fastest:
+                self.fastest = self.latency
+
+    def _now(self):
+        if self.clock is not None:
+            return self.clock.now()
+        return datetime.now(self.expected_open.tzinfo)
+
+    def slowdown(self):
+        if not self.latency or not self.fastest:
+            return 1
+        return min(self.max_slowdown, max(1, self.latency / self.fastest))
+
+    def desired_interval(self):
+        """
+        Interval to the next poll of one course, before the budget
+        """
+        if self.expected_open is None:
+            interval = self.interval
+        else:
+            to_open = (self.expected_open - self._now()).total_seconds()
+            if to_open > self.fast_before:
+                outside = to_open - self.fast_before
+            elif to_open < -self.fast_after:
+                outside = -self.fast_after - to_open
+            else:
+                outside = 0
+            interval = min(self.max_interval,
+                           self.min_interval + outside * self.backoff)
+        interval *= self.slowdown()
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def reserve(self):
+        """
+        Reserve the next poll, returns the seconds to wait for it
+        """
+        desired = self.desired_interval()
+        gap = 1 / self.rate
+        with self.lock:
+            now = time.monotonic()
+            del self.slots[:bisect.bisect_left(self.slots, now - gap)]
+            slot = now + desired
+            for reserved in self.slots:
+                if reserved + gap <= slot:
+                    continue
+                if slot + gap <= reserved:
+                    break
+                slot = reserved + gap
+            bisect.insort(self.slots, slot)
+        return slot - now
+
+    def wait(self):
+        """
+        Sleep until the next reserved poll
+        """
+        time.sleep(self.reserve())
@@ -0,0 +1,425 @@
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from lxml import html as lxml_html
+from .errors import CourseIdNotListed, CourseIdAmbiguous, LoadingFailed
+
+
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) hsp-booking-bot"
+
+_session = None
+
+
+def new_session(pool_size=10):
+    """
+    Create a requests session with a keep-alive connection pool
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["User-Agent"] = USER_AGENT
+    return session
+
+
+def get_session():
+    """
+    Return the module wide session, so that connections are reused
+    between course lookups.
+    """
+    global _session
+    if _session is None:
+        _session = new_session()
+    return _session
+
+
+def fetch_offer_page(url, session=None, timeout=20):
+    """
+    Load an offer page and return the raw html.
+    """
+    session = session or get_session()
+    try:
+        response = session.get(url, timeout=timeout)
+        response.raise_for_status()
+    except requests.Timeout as e:
+        print(e)
+        raise LoadingFailed("Timeout while loading course list page")
+    except requests.RequestException as e:
+        print(e)
+        raise LoadingFailed("Request for {} failed".format(url))
+
+    # return bytes, so lxml picks up the encoding declared by the page
+    return response.content
+
+
+def parse_offer_page(content):
+    return lxml_html.fromstring(content)
+
+
+def _text(element):
+    # mimic selenium's WebElement.text: collapse whitespace
+    return " ".join(element.text_content().split())
+
+
+def _cell_text(row, css_class, course_id):
+    cells = row.xpath('./td[@class="{}"]'.format(css_class))
+    if not cells:
+        raise CourseIdNotListed(course_id)
+    return _text(cells[0])
+
+
+def scrape_course(document, course_id):
+    """
+    Extract the course row and the booking button / status of a course
+    from a parsed offer page.
+    """
+    rows = document.xpath('//td[text()="{}"]/parent::tr'.format(course_id))
+    if not rows:
+        raise CourseIdNotListed(course_id)
+    if len(rows) > 1:
+        raise CourseIdAmbiguous(course_id)
+    row = rows[0]
+
+    booking = scrape_booking_element(document, course_id)
+    title = document.xpath("//div[@class='bs_head']")
+
+    scraped = {
+        "time": _cell_text(row, "bs_szeit", course_id),
+        "weekday": _cell_text(row, "bs_stag", course_id),
+        "location": _cell_text(row, "bs_sort", course_id),
+        "level": _cell_text(row, "bs_sdet", course_id),
+        "course_name": _text(title[0]) if title else None,
+    }
+    scraped.update(booking)
+    return scraped
+
+
+def scrape_booking_element(document, course_id):
+    """
+    Only the booking button / status of a course, without the details of
+    its row
+    """
+    xpath = "//a[@id='K{}']/following::*[1]".format(course_id)
+    bookbtn_or_status = document.xpath(xpath)
+    if not bookbtn_or_status:
+        raise CourseIdNotListed(course_id)
+    bookbtn_or_status = bookbtn_or_status[0]
+
+    return {
+        "booking_tag": bookbtn_or_status.tag,
+        "booking_class": bookbtn_or_status.get("class") or "",
+        "booking_text": _text(bookbtn_or_status),
+    }
+
+
+def parse_course_table(document):
+    """
+    Index of all course rows of a parsed offer page, built in one pass
+    over the cells of its table rows.
+    Returns course id -> the fields scrape_course() returns, or None for
+    course ids listed more than once.
+    """
+    title = document.xpath("//div[@class='bs_head']")
+    course_name = _text(title[0]) if title else None
+
+    table = {}
+    for row in document.iter("tr"):
+        cells = {}
+        for cell in row.iterchildren("td"):
+            cells.setdefault(cell.get("class"), cell)
+        if "bs_sknr" not in cells:
+            continue
+        course_id = _text(cells["bs_sknr"])
+        if course_id in table:
+            table[course_id] = None
+            continue
+        if not all(css_class in cells for css_class in
+                   ("bs_szeit", "bs_stag", "bs_sort", "bs_sdet")):
+            continue
+
+        anchor_id = "K" + course_id
+        anchor = next((a for a in row.iter("a")
+                       if a.get("id") == anchor_id), None)
+        if anchor is None:
+            continue
+        bookbtn_or_status = anchor.xpath("following::*[1]")
+        if not bookbtn_or_status:
+            continue
+        bookbtn_or_status = bookbtn_or_status[0]
+
+        table[course_id] = {
+            "time": _text(cells["bs_szeit"]),
+            "weekday": _text(cells["bs_stag"]),
+            "location": _text(cells["bs_sort"]),
+            "level": _text(cells["bs_sdet"]),
+            "course_name": course_name,
+            "booking_tag": bookbtn_or_status.tag,
+            "booking_class": bookbtn_or_status.get("class") or "",
+            "booking_text": _text(bookbtn_or_status),
+        }
+    return table
+
+
+def scrape_all_courses(document):
+    """
+    Extract every course row of a parsed offer page.
+    Returns course id -> the fields scrape_course() returns. Course ids
+    listed more than once are left out.
+    """
+    return {course_id: scraped for course_id, scraped in
+            parse_course_table(document).items() if scraped is not None}
+
+
+# Extracts the course row and the booking button / status of a course in
+# one webdriver command. Returns the fields scrape_course() returns, plus the
+# number of rows that start with the course id.
+COURSE_EXTRACTOR_JS = """
+var courseId = arguments[0];
+function text(el) {
+    return el ? (el.innerText || el.textContent).split(/\\s+/).join(" ").trim() : null;
+}
+function first(xpath) {
+    return document.evaluate(xpath, document, null,
+        XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+}
+var rows = document.evaluate('//td[text()="' + courseId + '"]/parent::tr',
+    document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+var result = {matches: rows.snapshotLength, url: window.location.href};
+if (rows.snapshotLength !== 1) {
+    return result;
+}
+var row = rows.snapshotItem(0);
+function cell(cssClass) {
+    return text(row.querySelector(':scope > td[class="' + cssClass + '"]'));
+}
+result.time = cell("bs_szeit");
+result.weekday = cell("bs_stag");
+result.location = cell("bs_sort");
+result.level = cell("bs_sdet");
+result.course_name = text(first("//div[@class='bs_head']"));
+var el = first("//a[@id='K" + courseId + "']/following::*[1]");
+if (el) {
+    result.booking_tag = el.tagName.toLowerCase();
+    result.booking_class = el.getAttribute("class") || "";
+    result.booking_text = text(el);
+}
+return result;
+"""
+
+
+# Reads only the booking button / status of a course, for courses whose
+# details are already known. Returns the booking fields of scrape_course().
+COURSE_STATUS_JS = """
+var courseId = arguments[0];
+var el = document.evaluate("//a[@id='K" + courseId + "']/following::*[1]",
+    document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+if (!el) {
+    return null;
+}
+return {
+    booking_tag: el.tagName.toLowerCase(),
+    booking_class: el.getAttribute("class") || "",
+    booking_text: (el.innerText || el.textContent).split(/\\s+/).join(" ").trim()
+};
+"""
+
+
+def status_from_extractor(result, course_id):
+    """
+    Validate the result of COURSE_STATUS_JS
+    """
+    if not result or result.get("booking_tag") is None:
+        raise CourseIdNotListed(course_id)
+    return {
+        "booking_tag": result["booking_tag"],
+        "booking_class": result.get("booking_class") or "",
+        "booking_text": result.get("booking_text") or "",
+    }
+
+
+def course_from_extractor(result, course_id):
+    """
+    Validate the result of COURSE_EXTRACTOR_JS
+    """
+    if not result or result.get("matches", 0) == 0:
+        raise CourseIdNotListed(course_id)
+    if result["matches"] > 1:
+        raise CourseIdAmbiguous(course_id)
+
+    fields = ("time", "weekday", "location", "level", "booking_tag")
+    if any(result.get(field) is None for field in fields):
+        raise CourseIdNotListed(course_id)
+
+    return {
+        "time": result["time"],
+        "weekday": result["weekday"],
+        "location": result["location"],
+        "level": result["level"],
+        "course_name": result.get("course_name"),
+        "booking_tag": result["booking_tag"],
+        "booking_class": result.get("booking_class") or "",
+        "booking_text": result.get("booking_text") or "",
+    }
+
+
+def classify_booking_element(tag, css_class, text):
+    """
+    Map the element following the course anchor to
+    (course_status, booking_possible, waitinglist_exists)
+    """
+    # If the element is a <span> ... </span> element,
+    # the course is not bookable and it contains a
+    # no-booking-possible status
+    if tag == "span":
+        return text, False, False
+
+    elif "bs_btn_warteliste" in css_class:
+        return "queue signup", False, True
+
+    elif "bs_btn_buchen" in css_class:
+        return "booking possible", True, False
+
+    else:
+        return "unknown", False, False
+
+
+class CourseStatus:
+    """
+    Status reporting shared by the synchronous and asynchronous
+    course classes, based on the scraped course attributes
+    """
+
+    def info(self):
+        infostr = "#{}: {} {}, {} {}".format(self.course.id or "",
+                                             self.course_name or "",
+                                             self.level or "",
+                                             self.weekday or "",
+                                             self.time or "")
+        return infostr
+
+    def status(self):
+        return "Status: {}".format(self.course_status)
+
+    def is_bookable(self):
+        return self.booking_possible
+
+    def has_waitinglist(self):
+        return self.waitinglist_exists
+
+    def _apply_scraped(self, scraped):
+        self.time = scraped["time"]
+        self.weekday = scraped["weekday"]
+        self.location = scraped["location"]
+        self.level = scraped["level"]
+        self.course_name = scraped["course_name"]
+        (self.course_status,
+         self.booking_possible,
+         self.waitinglist_exists) = classify_booking_element(
+            scraped["booking_tag"], scraped["booking_class"],
+            scraped["booking_text"])
+
+
+class FreshnessPolicy:
+    """
+    Decides when a page snapshot has to be reloaded.
+    max_age: seconds a snapshot is served before it is considered stale
+    """
+
+    def __init__(self, max_age=0.5):
+        self.max_age = max_age
+
+    def is_stale(self, snapshot):
+        return snapshot is None or snapshot.age() > self.max_age
+
+
+class PageSnapshot:
+    """
+    One load of an offer page, parsed once and shared by all lookups.
+    The course rows are indexed in one pass on the first lookup, so all
+    courses on the page are served from it.
+    Snapshots extracted in the browser carry no document, only the
+    courses (or just the booking statuses) that were extracted.
+    """
+
+    def __init__(self, url, document=None, loaded_at=None, courses=None,
+                 statuses=None):
+        self.url = url
+        self.document = document
+        self.loaded_at = loaded_at or time.monotonic()
+        self._courses = dict(courses or {})
+        self._statuses = dict(statuses or {})
+        self._table = None
+
+    @classmethod
+    def from_html(cls, url, content):
+        return cls(url, parse_offer_page(content))
+
+    def age(self):
+        return time.monotonic() - self.loaded_at
+
+    def _lookup(self, course_id, scrape=scrape_course):
+        if self._table is None:
+            self._table = parse_course_table(self.document)
+        if course_id not in self._table:
+            # not in the course table, e.g. an unusual page layout
+            return scrape(self.document, course_id)
+        if self._table[course_id] is None:
+            raise CourseIdAmbiguous(course_id)
+        return self._table[course_id]
+
+    def course(self, course_id):
+        if course_id not in self._courses:
+            if self.document is None:
+                raise CourseIdNotListed(course_id)
+            self._courses[course_id] = self._lookup(course_id)
+        return self._courses[course_id]
+
+    def status(self, course_id):
+        """
+        The booking fields of a course, without scraping its details
+        """
+        if course_id in self._courses:
+            return self._courses[course_id]
+        if course_id not in self._statuses:
+            if self.document is None:
+                raise CourseIdNotListed(course_id)
+            self._statuses[course_id] = self._lookup(
+                course_id, scrape_booking_element)
+        return self._statuses[course_id]
+
+
+class PageCache:
+    """
+    Offer page snapshots shared by all courses (and threads) watching the
+    same pages: a page is loaded once per freshness period, however many
+    of its courses are looked up, and concurrent loads of one page wait
+    for a single request.
+    """
+
+    def __init__(self, session=None, timeout=20, freshness=None):
+        self.session = session or new_session()
+        self.timeout = timeout
+        self.freshness = freshness or FreshnessPolicy()
+        self.snapshots = {}
+        self.loads = 0
+        self.lock = threading.Lock()
+        self._page_locks = {}
+
+    def snapshot(self, url, freshness=None, force=False):
+        """
+        A snapshot of the page at url that is not stale by freshness (the
+        cache's policy by default), loading the page if needed or if force
+        is set
+        """
+        freshness = freshness or self.freshness
+        with self.lock:
+            page_lock = self._page_locks.setdefault(url, threading.Lock())
+        with page_lock:
+            snapshot = self.snapshots.get(url)
+            if force or freshness.is_stale(snapshot):
+                content = fetch_offer_page(url, self.session, self.timeout)
+                snapshot = PageSnapshot.from_html(url, content)
+                self.snapshots[url] = snapshot
+                self.loads += 1
+            return snapshot
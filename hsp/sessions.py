@@ -0,0 +1,254 @@
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from urllib.parse import urljoin, urlencode
+
+import requests
+
+from .errors import InvalidCredentials, LoadingFailed, LoginFailed
+from .scraping import new_session, parse_offer_page
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: the store is written without a lock
+    fcntl = None
+
+
+# account login page of the booking system, relative to the offer pages
+LOGIN_PATH = "/cgi/konto.fcgi"
+DEFAULT_COOKIE_STORE = os.path.join(os.path.expanduser("~"), ".hsp",
+                                    "cookies.json")
+
+LOGIN_PASSWORD_XPATH = '//input[contains(@name, "pw_pwd_")]'
+LOGOUT_XPATH = ("//a[contains(translate(., 'ABMELDNLOGUT', 'abmeldnlogut'), "
+                "'abmelden') or contains(translate(., 'ABMELDNLOGUT', "
+                "'abmeldnlogut'), 'logout')]")
+
+
+def login_url_for(url):
+    """
+    Account login page of the booking system an offer page belongs to
+    """
+    return urljoin(url, LOGIN_PATH)
+
+
+class CookieStore:
+    """
+    Session cookies of logged in accounts on disk, keyed by email, so a
+    login is reused by later bookings and runs.
+    The file holds live sessions and is only readable by its owner.
+    Worker processes may update it at the same time: every change is made
+    under a file lock and written to a temporary file of its own. Failing
+    to store a login is reported, but doesn't fail the booking.
+    """
+
+    def __init__(self, path=DEFAULT_COOKIE_STORE):
+        self.path = path
+
+    def _read(self):
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _directory(self):
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    @contextmanager
+    def _locked(self):
+        # held across read-modify-write, so no process loses another
+        # account's cookies
+        if fcntl is None:
+            yield
+            return
+        self._directory()
+        fd = os.open(self.path + ".lock", os.O_WRONLY | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def _write(self, accounts):
+        # created with owner-only permissions
+        fd, tmp = tempfile.mkstemp(dir=self._directory(), suffix=".tmp",
+                                   prefix=os.path.basename(self.path) + ".")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(accounts, f)
+            os.replace(tmp, self.path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+    def _update(self, email, cookies):
+        try:
+            with self._locked():
+                accounts = self._read()
+                if cookies is None and email not in accounts:
+                    return
+                if cookies is None:
+                    del accounts[email]
+                else:
+                    accounts[email] = cookies
+                self._write(accounts)
+        except OSError as e:
+            print("[!] Storing the login of {} failed: {}".format(email, e))
+
+    def get(self, email):
+        """
+        The unexpired cookies of an account, empty if there are none
+        """
+        now = time.time()
+        return [cookie for cookie in self._read().get(email, [])
+                if cookie.get("expiry") is None or cookie["expiry"] > now]
+
+    def put(self, email, cookies):
+        self._update(email, cookies)
+
+    def invalidate(self, email):
+        self._update(email, None)
+
+
+def cookies_from_session(session):
+    return [{"name": cookie.name, "value": cookie.value,
+             "domain": cookie.domain, "path": cookie.path,
+             "expiry": cookie.expires, "secure": bool(cookie.secure)}
+            for cookie in session.cookies]
+
+
+def load_into_session(session, cookies):
+    for cookie in cookies:
+        session.cookies.set(cookie["name"], cookie["value"],
+                            domain=cookie.get("domain") or "",
+                            path=cookie.get("path") or "/",
+                            expires=cookie.get("expiry"),
+                            secure=cookie.get("secure", False))
+
+
+def cookies_from_driver(driver):
+    return [{"name": cookie["name"], "value": cookie["value"],
+             "domain": cookie.get("domain"), "path": cookie.get("path", "/"),
+             "expiry": cookie.get("expiry"),
+             "secure": cookie.get("secure", False)}
+            for cookie in driver.get_cookies()]
+
+
+def add_to_driver(driver, cookies):
+    """
+    Add the cookies to the browser, which has to show a page of the
+    booking system already
+    """
+    for cookie in cookies:
+        # the domain defaults to the one of the current page
+        browser_cookie = {"name": cookie["name"], "value": cookie["value"],
+                          "path": cookie.get("path") or "/",
+                          "secure": cookie.get("secure", False)}
+        if cookie.get("expiry") is not None:
+            browser_cookie["expiry"] = int(cookie["expiry"])
+        driver.add_cookie(browser_cookie)
+
+
+def _request(session, method, url, timeout, **kwargs):
+    try:
+        response = session.request(method, url, timeout=timeout, **kwargs)
+        response.raise_for_status()
+    except requests.Timeout as e:
+        print(e)
+        raise LoadingFailed("Timeout while loading {}".format(url))
+    except requests.RequestException as e:
+        print(e)
+        raise LoadingFailed("Request for {} failed".format(url))
+    return response
+
+
+def _shows_login(document, email=None):
+    # a positive sign of a login: the account's email on the page or a
+    # logout link; a page merely without the password field (e.g. a wrong
+    # login URL) is no login
+    if email and email.lower() in document.text_content().lower():
+        return True
+    return bool(document.xpath(LOGOUT_XPATH))
+
+
+def is_logged_in(session, login_url, timeout=20, email=None):
+    """
+    Whether the session cookies belong to a live login: the login page
+    asks for no password and shows the account (email) or a logout link.
+    """
+    response = _request(session, "GET", login_url, timeout)
+    document = parse_offer_page(response.content)
+    return not document.xpath(LOGIN_PASSWORD_XPATH) and \
+        _shows_login(document, email)
+
+
+def login(session, login_url, credentials, timeout=20):
+    """
+    Log the session in with the email and password of the credentials
+    """
+    if not credentials or not credentials.password:
+        raise InvalidCredentials("Credentials without a password")
+
+    response = _request(session, "GET", login_url, timeout)
+    document = parse_offer_page(response.content)
+    password_input = document.xpath(LOGIN_PASSWORD_XPATH)
+    if not password_input and _shows_login(document, credentials.email):
+        # logged in already
+        return
+    if not password_input:
+        raise LoginFailed("No login form on {}".format(login_url))
+    password_input = password_input[0]
+    form = next(password_input.iterancestors("form"), None)
+    if form is None:
+        raise LoginFailed("No login form on {}".format(login_url))
+
+    values = [(name, value) for name, value in form.form_values()
+              if name not in ("pw_email", password_input.get("name"))]
+    values += [("pw_email", credentials.email),
+               (password_input.get("name"), credentials.password)]
+    action = urljoin(response.url, form.get("action") or response.url)
+    response = _request(session, "POST", action, timeout,
+                        data=urlencode(values),
+                        headers={"Content-Type":
+                                 "application/x-www-form-urlencoded"})
+
+    document = parse_offer_page(response.content)
+    if document.xpath(LOGIN_PASSWORD_XPATH):
+        error = document.xpath("//*[contains(@class, 'bs_text_red')]")
+        raise LoginFailed(" ".join(error[0].text_content().split())
+                          if error else "Login failed")
+    if not _shows_login(document, credentials.email):
+        raise LoginFailed("{} did not confirm the login of {}".format(
+            action, credentials.email))
+
+
+def ensure_login(credentials, login_url, store, session=None, timeout=20):
+    """
+    Session cookies of a live login of the account. The stored cookies are
+    reused if they are still valid, otherwise the account is logged in
+    again and the new cookies are stored.
+    """
+    session = session or new_session()
+    cookies = store.get(credentials.email)
+    if cookies:
+        load_into_session(session, cookies)
+        if is_logged_in(session, login_url, timeout, credentials.email):
+            return cookies_from_session(session)
+        print("[*] Session of {} expired, logging in again".format(
+            credentials.email))
+        store.invalidate(credentials.email)
+        session.cookies.clear()
+
+    login(session, login_url, credentials, timeout)
+    cookies = cookies_from_session(session)
+    store.put(credentials.email, cookies)
+    return cookies
@@ -0,0 +1,171 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urldefrag
+
+import yaml
+
+from .course import Course
+from .errors import Error
+from .scraping import (classify_booking_element, fetch_offer_page, new_session,
+                       PageSnapshot, scrape_all_courses)
+
+
+FIELDS = ("id", "course_name", "level", "weekday", "time", "location",
+          "status", "bookable", "waitinglist", "latency_ms", "url", "error")
+
+
+class StatusJob:
+    """
+    What to check: one course (course_id and url) or, without a course_id,
+    every course on the offer page at url
+    """
+
+    def __init__(self, url, course_id=None, error=None):
+        self.url = url
+        self.course_id = course_id
+        self.error = error
+
+
+def parse_target(target, catalog=None):
+    """
+    StatusJob for a course id (looked up in the course catalog), an offer
+    page URL (all of its courses) or an offer page URL with the course id
+    as fragment (https://.../_Floorball.html#12231858)
+    """
+    if "://" in target:
+        url, course_id = urldefrag(target)
+        return StatusJob(url, course_id or None)
+    try:
+        course = Course.from_id(target, catalog=catalog)
+    except Error as e:
+        return StatusJob(None, target, e.msg)
+    return StatusJob(course.url, course.id)
+
+
+def load_job_file(path, catalog=None):
+    """
+    StatusJobs of a JSON or YAML job file: a list (or {"courses": [...]})
+    of course ids, URLs as taken by parse_target, or {"id": .., "url": ..}
+    Raises ValueError for a malformed file.
+    """
+    with open(path, "r", encoding="utf8") as f:
+        try:
+            if path.upper().endswith(".JSON"):
+                entries = json.load(f)
+            else:
+                entries = yaml.safe_load(f)
+        except (ValueError, yaml.YAMLError) as e:
+            raise ValueError("Malformed job file {}: {}".format(path, e))
+    if isinstance(entries, dict):
+        entries = entries.get("courses", [])
+    if entries is not None and not isinstance(entries, list):
+        raise ValueError("Job file {} has no list of courses".format(path))
+
+    jobs = []
+    for entry in entries or []:
+        if isinstance(entry, dict) and entry.get("url"):
+            course_id = entry.get("id")
+            jobs.append(StatusJob(entry["url"],
+                                  str(course_id) if course_id else None))
+        elif isinstance(entry, dict):
+            jobs.append(parse_target(str(entry.get("id")), catalog))
+        else:
+            jobs.append(parse_target(str(entry), catalog))
+    return jobs
+
+
+def _row(course_id, url, scraped=None, latency=None, error=None):
+    row = dict.fromkeys(FIELDS)
+    row.update({"id": course_id, "url": url, "error": error})
+    if latency is not None:
+        row["latency_ms"] = round(latency * 1000, 1)
+    if scraped is not None:
+        status, bookable, waitinglist = classify_booking_element(
+            scraped["booking_tag"], scraped["booking_class"],
+            scraped["booking_text"])
+        row.update({
+            "course_name": scraped["course_name"], "level": scraped["level"],
+            "weekday": scraped["weekday"], "time": scraped["time"],
+            "location": scraped["location"], "status": status,
+            "bookable": bookable, "waitinglist": waitinglist})
+    return row
+
+
+def check_status(jobs, max_workers=8, timeout=20, session=None):
+    """
+    Status of all jobs. Every offer page is loaded once, however many of
+    the jobs are on it, and the pages are loaded concurrently.
+    session: a pooled session to reuse, e.g. of a long running process
+    Returns one dict per course (see FIELDS), in the order of the jobs.
+    """
+    urls = []
+    for job in jobs:
+        if job.url is not None and job.url not in urls:
+            urls.append(job.url)
+
+    session = session or new_session(pool_size=max_workers)
+
+    def load(url):
+        start = time.perf_counter()
+        try:
+            content = fetch_offer_page(url, session, timeout)
+            snapshot = PageSnapshot.from_html(url, content)
+        except Error as e:
+            return None, time.perf_counter() - start, e.msg
+        return snapshot, time.perf_counter() - start, None
+
+    pages = {}
+    if urls:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            pages = dict(zip(urls, pool.map(load, urls)))
+
+    rows = []
+    for job in jobs:
+        if job.error is not None:
+            rows.append(_row(job.course_id, job.url, error=job.error))
+            continue
+        snapshot, latency, error = pages[job.url]
+        if error is not None:
+            rows.append(_row(job.course_id, job.url, latency=latency,
+                             error=error))
+        elif job.course_id is None:
+            for course_id, scraped in \
+                    scrape_all_courses(snapshot.document).items():
+                rows.append(_row(course_id, job.url, scraped, latency))
+        else:
+            try:
+                scraped = snapshot.course(job.course_id)
+            except Error as e:
+                rows.append(_row(job.course_id, job.url, latency=latency,
+                                 error=e.msg))
+            else:
+                rows.append(_row(job.course_id, job.url, scraped, latency))
+    return rows
+
+
+def format_table(rows):
+    lines = ["{:<10} {:<28} {:<14} {:<8} {:<12} {:<20} {:>9}".format(
+        "id", "course", "level", "weekday", "time", "status", "ms")]
+    for row in rows:
+        if row["error"] is not None:
+            lines.append("{:<10} [ERROR] {}".format(row["id"] or "",
+                                                    row["error"]))
+            continue
+        lines.append("{:<10} {:<28} {:<14} {:<8} {:<12} {:<20} {:>9}".format(
+            row["id"], (row["course_name"] or "")[:28],
+            (row["level"] or "")[:14], row["weekday"] or "",
+            row["time"] or "", (row["status"] or "")[:20],
+            row["latency_ms"]))
+    return "\n".join(lines)
+
+
+def format_rows(rows, output="table"):
+    """
+    rows as a table, a JSON list or NDJSON (one JSON object per line)
+    """
+    if output == "json":
+        return json.dumps(rows, indent=2, ensure_ascii=False)
+    if output == "ndjson":
+        return "\n".join(json.dumps(row, ensure_ascii=False) for row in rows)
+    return format_table(rows)
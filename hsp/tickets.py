@@ -0,0 +1,160 @@
+import atexit
+import gzip
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from .errors import BookingFailed, BookingRefused
+
+
+# labels of the ticket rows, the HSZ pages are German
+NUMBER_LABELS = ("buchungsnummer", "buchungsnr")
+COURSE_LABELS = ("kursnummer", "kursnr")
+PRICE_LABELS = ("entgelt", "preis", "gebühr")
+
+
+def _text(element):
+    return " ".join(element.text_content().split())
+
+
+def parse_ticket(document):
+    """
+    label -> value of the two column rows on the ticket page
+    """
+    details = {}
+    for row in document.xpath("//tr[count(td) = 2]"):
+        label, value = row.xpath("./td")
+        details[_text(label)] = _text(value)
+    return details
+
+
+def _find(details, labels):
+    for label, value in details.items():
+        if label.lower().rstrip(":").strip() in labels:
+            return value or None
+    return None
+
+
+class Ticket:
+    """
+    The booking data of a ticket page.
+    details: label -> value of all rows, see parse_ticket
+    """
+
+    def __init__(self, booking_number, course_id, price, details):
+        self.booking_number = booking_number
+        self.course_id = course_id
+        self.price = price
+        self.details = details
+
+    @classmethod
+    def from_details(cls, details):
+        return cls(_find(details, NUMBER_LABELS),
+                   _find(details, COURSE_LABELS),
+                   _find(details, PRICE_LABELS), details)
+
+    def __str__(self):
+        return "Ticket #{} for course {} ({})".format(
+            self.booking_number, self.course_id, self.price or "no price")
+
+
+def find_refusal(document):
+    """
+    Message of a page that refused the booking: the confirmation form came
+    back, or an error is shown. None for any other page.
+    """
+    error = document.xpath("//*[contains(@class, 'bs_text_red')]")
+    message = _text(error[0]) if error else None
+    if document.xpath("//input[@type='submit'][contains(@value, 'buchen')]"):
+        return message or "The confirmation form came back"
+    return message
+
+
+def verify_ticket(ticket, course_id, refusal=None):
+    """
+    Raises BookingFailed unless the ticket has a booking number and is for
+    course_id. refusal: message of the page if it refused the booking (see
+    find_refusal); without a booking number, BookingRefused is raised then.
+    A ticket that can't be read is not a refusal, the course may have been
+    booked.
+    """
+    if ticket.booking_number is None and refusal is not None:
+        raise BookingRefused(refusal)
+    if ticket.booking_number is None:
+        raise BookingFailed("No booking number on the ticket page")
+    if ticket.course_id is not None and \
+            ticket.course_id.strip() != str(course_id):
+        raise BookingFailed("Ticket is for course {}, not {}".format(
+            ticket.course_id, course_id))
+
+
+def render_ticket_page(content, url=None):
+    """
+    The ticket HTML as a standalone page: with the page URL as base, its
+    stylesheets and links still resolve when the file is opened locally.
+    """
+    if isinstance(content, bytes):
+        content = content.decode("utf8", "replace")
+    if url and "<base " not in content:
+        base = '<base href="{}">'.format(url)
+        content, count = re.subn(r"(<head[^>]*>)", r"\1" + base, content,
+                                 count=1, flags=re.IGNORECASE)
+        if not count:
+            content = base + content
+    return content.encode("utf8")
+
+
+def write_confirmation(content, outfile, url=None):
+    """
+    Render the ticket and write it to outfile, gzip compressed if outfile
+    ends with .gz
+    """
+    page = render_ticket_page(content, url)
+    if outfile.endswith(".gz"):
+        page = gzip.compress(page)
+    with open(outfile, "wb") as f:
+        f.write(page)
+    print("[*] Booking ticket saved to {}".format(outfile))
+    return outfile
+
+
+class ConfirmationWriter:
+    """
+    Writes tickets in a background thread, so the driver can book the next
+    course while the last ticket is still being rendered and written.
+    """
+
+    def __init__(self):
+        self.pool = ThreadPoolExecutor(max_workers=1,
+                                       thread_name_prefix="hsp-tickets")
+
+    def submit(self, content, outfile, url=None):
+        """
+        Queue a ticket, returns a Future of the written file
+        """
+        future = self.pool.submit(write_confirmation, content, outfile, url)
+        future.add_done_callback(_report_failure)
+        return future
+
+    def close(self, wait=True):
+        self.pool.shutdown(wait=wait)
+
+
+def _report_failure(future):
+    if future.exception() is not None:
+        print("[!] Saving the booking ticket failed: {!r}".format(
+            future.exception()))
+
+
+_writer = None
+
+
+def default_writer():
+    """
+    The ConfirmationWriter shared by all bookings of the process, pending
+    tickets are written before it exits
+    """
+    global _writer
+    if _writer is None:
+        _writer = ConfirmationWriter()
+        atexit.register(_writer.close)
+    return _writer
@@ -0,0 +1,74 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Tracer:
+    """
+    Records timed spans and writes them as Chrome trace JSON, which loads
+    in chrome://tracing and Perfetto.
+    t0: time.time() timestamp of the booking window opening (T-0). The
+        trace starts when the Tracer is created; T-0 is marked as an
+        instant event and every span carries its start relative to T-0.
+    """
+
+    def __init__(self, t0=None):
+        self.start = time.time()
+        self.t0 = t0
+        self.events = []
+
+    def _ts(self, timestamp):
+        # microseconds since the start of the trace
+        return (timestamp - self.start) * 1e6
+
+    @contextmanager
+    def span(self, name, **args):
+        start = time.time()
+        try:
+            yield
+        finally:
+            end = time.time()
+            if self.t0 is not None:
+                args["since_t0_ms"] = round((start - self.t0) * 1000, 3)
+            self.events.append({
+                "name": name, "ph": "X", "ts": self._ts(start),
+                "dur": (end - start) * 1e6, "pid": os.getpid(),
+                "tid": threading.get_ident(), "args": args})
+
+    def counter(self, name, **values):
+        """
+        Records values (e.g. memory use) as a counter track
+        """
+        values = {key: value for key, value in values.items()
+                  if value is not None}
+        self.events.append({"name": name, "ph": "C",
+                            "ts": self._ts(time.time()), "pid": os.getpid(),
+                            "tid": threading.get_ident(), "args": values})
+
+    def write(self, outfile):
+        events = list(self.events)
+        if self.t0 is not None:
+            events.append({"name": "T-0", "ph": "i", "s": "g",
+                           "ts": self._ts(self.t0), "pid": os.getpid(),
+                           "tid": threading.get_ident()})
+        with open(outfile, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        print("[*] Trace saved to {}".format(outfile))
+
+
+class NullTracer:
+    """
+    Tracer that records nothing
+    """
+
+    @contextmanager
+    def span(self, name, **args):
+        yield
+
+    def counter(self, name, **values):
+        pass
+
+
+NULL_TRACER = NullTracer()
@@ -0,0 +1,82 @@
+import time
+from datetime import datetime
+
+from .booking import HSPCourse
+from .sessions import ensure_login, login_url_for
+
+
+def warm_login(course, credentials=None, cookie_store=None, login_url=None):
+    """
+    With credentials that have a password and a cookie_store, log the
+    account in now (or reuse its stored session), so the booking form
+    needs no login. Returns the session cookies, None without a login.
+    """
+    if credentials is None or not credentials.password or \
+            cookie_store is None:
+        return None
+    return ensure_login(credentials, login_url or login_url_for(course.url),
+                        cookie_store)
+
+
+def warm_up(course, start_driver, metadata=None, credentials=None,
+            cookie_store=None, login_url=None, backend="browser"):
+    """
+    Launch a browser and park it on the offer page of the course.
+    The course row is resolved here, so the returned HSPCourse only needs
+    a refresh and a click once the booking window opens.
+    With the "http" backend, the course is polled over HTTP and the
+    parked browser is only used for the booking.
+    The account is logged in as with warm_login.
+    """
+    booking = HSPCourse(course, backend=backend, start_driver=start_driver,
+                        metadata=metadata, cookie_store=cookie_store)
+    if backend == "http":
+        booking.park()
+    cookies = warm_login(course, credentials, cookie_store, login_url)
+    if cookies is not None:
+        booking.use_session(credentials, cookies)
+    print("... warmed up " + booking.info())
+    return booking
+
+
+def _sleep(seconds, cancelled):
+    # True if cancelled meanwhile
+    if cancelled is None:
+        time.sleep(seconds)
+        return False
+    return cancelled.wait(seconds)
+
+
+def keep_warm(bookings, until, interval=30, clock=None, cancelled=None):
+    """
+    Keep warmed up sessions alive with light page refreshes until the
+    datetime until. No refresh is started in the last interval before
+    until, so the sessions are idle when the window opens.
+    With a synchronised ServerClock, until is server time and reached
+    precisely.
+    cancelled: threading.Event ending the wait early.
+    Returns False if it was cancelled.
+    """
+    while True:
+        now = clock.now() if clock else datetime.now(until.tzinfo)
+        remaining = (until - now).total_seconds()
+        if remaining <= 1:
+            break
+        if _sleep(min(interval, remaining - 1), cancelled):
+            return False
+        if remaining > 2 * interval:
+            for booking in bookings:
+                try:
+                    booking.refresh(force=True)
+                except Exception as e:
+                    print("[!] keep-alive for course {} failed: {}".format(
+                        booking.course.id, e))
+
+    if cancelled is not None and cancelled.is_set():
+        return False
+    if clock is not None:
+        clock.sleep_until(until)
+    elif _sleep(max(0, (until - datetime.now(until.tzinfo)).total_seconds()),
+                cancelled):
+        return False
+    return True
@@ -22,6 +22,9 @@ setuptools.setup(
     install_requires=[
         "pyyaml",
         "selenium",
+        "requests",
+        "lxml",
+        "aiohttp",
         "Gecko"
         ],
     scripts=[
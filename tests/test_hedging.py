@@ -0,0 +1,170 @@
+from functools import partial
+from urllib.parse import urljoin, urlencode
+
+import pytest
+from selenium.common.exceptions import NoSuchElementException
+
+from hsp.booking import HSPCourse
+from hsp.course import Course
+from hsp.credentials import Credentials
+from hsp.errors import BookingFailed, BookingRefused, HedgeCancelled
+from hsp.hedging import ConfirmGate, book_hedged
+from hsp.httpbooking import HTTPBooking
+from hsp import mockserver
+from hsp.mockserver import MockHSZ, MockCourse, start_server
+from hsp.scraping import new_session, parse_offer_page
+from hsp.tickets import ConfirmationWriter
+
+
+COURSE_ID = "12231858"
+PAGE = "_Floorball_Spielbetrieb"
+
+credentials = Credentials(
+    name="Max", surname="Mustermann", gender="M", street="Teststr.",
+    number="1", zip_code="52062", city="Aachen", status="S-RWTH",
+    pid="331898", email="max.mustermann@mail.com", tel="0123456789",
+    iban="DE02100100100006820101")
+
+
+class RequestsElement:
+
+    def __init__(self, driver, element):
+        self.driver = driver
+        self.element = element
+
+    def send_keys(self, text):
+        self.element.value = (self.element.value or "") + text
+
+    def submit(self):
+        form = next(self.element.iterancestors("form"))
+        values = list(form.form_values())
+        if self.element.get("name"):
+            values.append((self.element.get("name"),
+                           self.element.get("value", "")))
+        action = urljoin(self.driver.current_url, form.get("action"))
+        response = self.driver.session.post(
+            action, data=urlencode(values),
+            headers={"Content-Type": "application/x-www-form-urlencoded"})
+        self.driver.load(response.url, response.content)
+
+
+class RequestsDriver:
+    """
+    The part of a webdriver the final confirmation uses, replaying the
+    form POSTs on a requests session
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.current_url = None
+        self.page_source = None
+        self.document = None
+
+    def load(self, url, content):
+        self.current_url = url
+        self.page_source = content.decode("utf8")
+        self.document = parse_offer_page(content)
+
+    def find_elements(self, by, xpath):
+        return [RequestsElement(self, element)
+                for element in self.document.xpath(xpath)]
+
+    def find_element(self, by, xpath):
+        found = self.find_elements(by, xpath)
+        if not found:
+            raise NoSuchElementException(xpath)
+        return found[0]
+
+
+@pytest.fixture
+def mock(request):
+    refusals = getattr(request, "param", 1)
+    hsz = MockHSZ([MockCourse(COURSE_ID, page=PAGE)], refusals=refusals)
+    server, base_url = start_server(hsz)
+    yield hsz, Course(COURSE_ID, hsz.offer_url(base_url, PAGE))
+    server.shutdown()
+
+
+def browser_hedge(course):
+    # a browser session on the confirmation page, the form submitted
+    session = new_session()
+    page = HTTPBooking(course, session=session).book(credentials, test=True)
+    driver = RequestsDriver(session)
+    driver.load(page.url, page.content)
+    booking = HSPCourse(course, driver=driver, backend="http",
+                        writer=ConfirmationWriter())
+    booking._booking_page = driver.current_url
+    booking._bp_enter_confirm_email(credentials.email)
+    return booking
+
+
+def test_refused_browser_hedge_lets_the_next_confirm(mock, tmp_path):
+    hsz, course = mock
+    hedges = [browser_hedge(course) for _ in range(3)]
+    gate = ConfirmGate()
+    outfile = str(tmp_path / "ticket.html")
+
+    with pytest.raises(BookingRefused):
+        hedges[0]._bp_confirm_gated(partial(gate.confirm, 1), False, outfile)
+    assert gate.winner is None
+
+    hedges[1]._bp_confirm_gated(partial(gate.confirm, 2), False, outfile)
+    assert gate.winner == 2
+    assert hedges[1].ticket.course_id == COURSE_ID
+
+    with pytest.raises(HedgeCancelled):
+        hedges[2]._bp_confirm_gated(partial(gate.confirm, 3), False, outfile)
+    assert len(hsz.courses[COURSE_ID].bookings) == 1
+
+
+def test_refused_http_hedge_lets_the_next_confirm(mock, tmp_path):
+    hsz, course = mock
+    result = book_hedged(course, credentials, None, hedges=3, mode="http",
+                         fire=True,
+                         confirmation_file=str(tmp_path / "ticket.html"))
+
+    assert result.booked
+    outcomes = sorted(hedge["outcome"] for hedge in result.hedges)
+    assert outcomes == ["cancelled", "failed", "won"]
+    assert len(hsz.courses[COURSE_ID].bookings) == 1
+
+
+def render_unknown_ticket(course, number, data):
+    # a booking the ticket parser doesn't recognise
+    return mockserver._page("Buchungsbestätigung", (
+        "<table><tr><td>Vorgang</td><td>{}</td></tr>"
+        "<tr><td>Angebot</td><td>{}</td></tr></table>").format(
+            number, course.id))
+
+
+@pytest.mark.parametrize("mock", [0], indirect=True)
+def test_unreadable_ticket_keeps_the_gate_closed(mock, tmp_path,
+                                                 monkeypatch):
+    hsz, course = mock
+    monkeypatch.setattr(mockserver, "render_ticket", render_unknown_ticket)
+    hedges = [browser_hedge(course) for _ in range(2)]
+    gate = ConfirmGate()
+    outfile = str(tmp_path / "ticket.html")
+
+    with pytest.raises(BookingFailed):
+        hedges[0]._bp_confirm_gated(partial(gate.confirm, 1), False, outfile)
+    assert gate.winner == 1
+
+    with pytest.raises(HedgeCancelled):
+        hedges[1]._bp_confirm_gated(partial(gate.confirm, 2), False, outfile)
+    assert len(hsz.courses[COURSE_ID].bookings) == 1
+
+
+@pytest.mark.parametrize("mock", [0], indirect=True)
+def test_unreadable_http_ticket_cancels_the_other_hedges(mock, tmp_path,
+                                                         monkeypatch):
+    hsz, course = mock
+    monkeypatch.setattr(mockserver, "render_ticket", render_unknown_ticket)
+    result = book_hedged(course, credentials, None, hedges=3, mode="http",
+                         fire=True,
+                         confirmation_file=str(tmp_path / "ticket.html"))
+
+    assert not result.booked
+    outcomes = sorted(hedge["outcome"] for hedge in result.hedges)
+    assert outcomes == ["cancelled", "cancelled", "failed"]
+    assert len(hsz.courses[COURSE_ID].bookings) == 1